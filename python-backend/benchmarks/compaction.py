@@ -0,0 +1,96 @@
+"""Token savings and answer retention of search result compaction.
+
+For every fixture in compaction_fixtures.json this reports the estimated
+tokens of the raw and compacted search results and whether the expected
+answer is still present in what the consolidation prompt would see. With
+`--llm` it also runs the real consolidation call on both versions and checks
+the answers (this needs API keys and network access).
+
+Run from the python-backend directory:
+
+    python -m benchmarks.compaction --budget 200
+"""
+import argparse
+import json
+import os
+import tempfile
+
+os.environ.setdefault("BRAVE_API_KEY", "benchmark")
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+os.environ.setdefault(
+    "URL_DATABASE",
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}")
+
+import src.python_backend.compaction as compaction
+from src.python_backend.ai_functions import consolidate_search_results
+
+FIXTURES = os.path.join(os.path.dirname(__file__),
+                        "compaction_fixtures.json")
+
+
+def contains(text, expected: str):
+    return expected.lower() in str(text).lower()
+
+
+def consolidate(fixture, search_results):
+    response = consolidate_search_results(fixture["description"],
+                                          fixture["element"],
+                                          fixture["index_value"],
+                                          fixture["query"], search_results)
+    return response.answer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget",
+                        type=int,
+                        default=compaction.SEARCH_RESULTS_TOKEN_BUDGET,
+                        help="token budget for each cell's search results")
+    parser.add_argument("--llm",
+                        action="store_true",
+                        help="also compare real consolidation answers")
+    args = parser.parse_args()
+
+    with open(FIXTURES) as f:
+        fixtures = json.load(f)
+
+    total_before = total_after = retained = 0
+    llm_correct = {"raw": 0, "compacted": 0}
+    print(f"{'query':50} {'before':>7} {'after':>7} {'answer kept':>12}")
+    for fixture in fixtures:
+        raw = fixture["search_results"]
+        compacted = compaction.compact_search_results(fixture["query"], raw,
+                                                      args.budget)
+        before = compaction.estimate_tokens(str(raw))
+        after = compaction.estimate_tokens(str(compacted))
+        kept = contains(compacted, fixture["expected"])
+        total_before += before
+        total_after += after
+        retained += kept
+        print(f"{fixture['query'][:50]:50} {before:>7} {after:>7} "
+              f"{'yes' if kept else 'NO':>12}")
+
+        if args.llm:
+            # consolidate_search_results compacts on its own, so turn that
+            # off to get the raw baseline.
+            compaction.SEARCH_COMPACTION_ENABLED = False
+            raw_answer = consolidate(fixture, raw)
+            compaction.SEARCH_COMPACTION_ENABLED = True
+            compacted_answer = consolidate(fixture, raw)
+            llm_correct["raw"] += contains(raw_answer, fixture["expected"])
+            llm_correct["compacted"] += contains(compacted_answer,
+                                                 fixture["expected"])
+            print(f"    raw: {raw_answer!r}  compacted: {compacted_answer!r}")
+
+    print(f"\ntokens: {total_before} -> {total_after} "
+          f"({1 - total_after / total_before:.0%} fewer), "
+          f"expected answer kept in {retained}/{len(fixtures)} fixtures")
+    if args.llm:
+        print(f"correct answers: raw {llm_correct['raw']}/{len(fixtures)}, "
+              f"compacted {llm_correct['compacted']}/{len(fixtures)}")
+
+
+if __name__ == "__main__":
+    main()
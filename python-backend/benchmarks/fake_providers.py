@@ -0,0 +1,354 @@
+"""Local stand-ins for the Brave search API and the LLM providers.
+
+One app serves all of them, so the backend can be pointed at it with
+BRAVE_SEARCH_URL, ANTHROPIC_BASE_URL, OPENAI_BASE_URL and GROQ_BASE_URL:
+
+    Brave      GET  /res/v1/web/search
+    Anthropic  POST /v1/messages
+    OpenAI     POST /v1/chat/completions
+    Groq       POST /openai/v1/chat/completions
+
+Structured outputs are generated from the JSON schema the SDK (or
+instructor) sends, with list lengths taken from the prompt's input so
+batched answers line up. Each service has its own latency, error rate and
+rate limit.
+
+Run it on its own to point a dev server at it:
+
+    python -m benchmarks.fake_providers --port 9000 --latency 0.3
+"""
+from dataclasses import dataclass, field
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+DEFAULT_LIST_LENGTH = 5
+
+
+@dataclass
+class FakeService:
+    latency: float = 0.2
+    jitter: float = 0.1
+    error_rate: float = 0.0
+    rate_limit: float = 0.0
+    calls: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    tokens: float = 0.0
+    updated_at: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def admit(self):
+        # Token bucket that rejects instead of waiting, like a real API.
+        if self.rate_limit <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate_limit,
+                self.tokens + (now - self.updated_at) * self.rate_limit)
+            self.updated_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    async def respond(self, make_body, error_status: int = 500):
+        self.calls += 1
+        if not self.admit():
+            self.rate_limited += 1
+            return JSONResponse({"error": {"type": "rate_limit_error"}},
+                                status_code=429,
+                                headers={"retry-after": "1"})
+        await asyncio.sleep(
+            max(0.0, self.latency + random.uniform(-1, 1) * self.jitter))
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return JSONResponse({"error": {"type": "api_error"}},
+                                status_code=error_status)
+        return JSONResponse(make_body())
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+        }
+
+
+def prompt_input(prompt: str):
+    # The backend's prompts end with their input as JSON after "Here is the
+    # input:"; list lengths in fake answers follow it.
+    _, _, tail = prompt.rpartition("Here is the input:")
+    start = tail.find("{")
+    if start < 0:
+        return {}
+    try:
+        value, _ = json.JSONDecoder().raw_decode(tail[start:])
+    except ValueError:
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+def list_length(name: str, context: dict):
+    if name == "answers":
+        return len(context.get("cells", [])) or DEFAULT_LIST_LENGTH
+    if name == "queries":
+        return len(context.get("columns", [])) or DEFAULT_LIST_LENGTH
+    return DEFAULT_LIST_LENGTH
+
+
+def fake_value(schema: dict, defs: dict, context: dict, name: str = ""):
+    if "$ref" in schema:
+        schema = defs[schema["$ref"].rsplit("/", 1)[-1]]
+    schema_type = schema.get("type")
+    if schema_type == "object" or "properties" in schema:
+        return {
+            key: fake_value(value, defs, context, key)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [
+            fake_value(schema.get("items", {}), defs, context, name)
+            for _ in range(list_length(name, context))
+        ]
+    if schema_type == "integer":
+        return random.randint(1, 1000)
+    if schema_type == "number":
+        return round(random.uniform(1, 1000), 2)
+    if schema_type == "boolean":
+        return random.random() < 0.5
+    if name == "sources":
+        return f"https://example.com/{uuid.uuid4().hex[:8]}"
+    return f"fake {name or 'value'} {random.randint(1, 1000)}"
+
+
+def fake_structured(schema: dict, prompt: str):
+    return fake_value(schema, schema.get("$defs", {}), prompt_input(prompt))
+
+
+def message_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(
+                block.get("text", "") for block in content
+                if isinstance(block, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+
+def embedded_schema(text: str):
+    # instructor's JSON mode puts the schema in a system message.
+    _, _, tail = text.partition("json_schema:")
+    start = tail.find("{")
+    if start < 0:
+        return None
+    try:
+        schema, _ = json.JSONDecoder().raw_decode(tail[start:])
+    except ValueError:
+        return None
+    return schema
+
+
+def brave_results(query: str, count: int = 10):
+    return {
+        "web": {
+            "results": [{
+                "title": f"{query} - result {i}",
+                "url": f"https://example.com/{i}/{uuid.uuid4().hex[:8]}",
+                "description": f"Result {i} about {query}. " * 3,
+                "extra_snippets": [
+                    f"Snippet {j} of result {i} mentions {query}."
+                    for j in range(3)
+                ],
+            } for i in range(count)]
+        }
+    }
+
+
+def anthropic_message(body: dict):
+    prompt = message_text(body.get("messages", []))
+    tools = body.get("tools") or []
+    if tools:
+        tool = tools[0]
+        content = [{
+            "type": "tool_use",
+            "id": f"toolu_{uuid.uuid4().hex[:12]}",
+            "name": tool["name"],
+            "input": fake_structured(tool["input_schema"], prompt),
+        }]
+        stop_reason = "tool_use"
+    else:
+        content = [{"type": "text", "text": "fake search query"}]
+        stop_reason = "end_turn"
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:12]}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "fake"),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": len(prompt) // 4,
+            "output_tokens": 50
+        },
+    }
+
+
+def chat_completion(body: dict):
+    prompt = message_text(body.get("messages", []))
+    response_format = body.get("response_format") or {}
+    schema = None
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+    elif response_format.get("type") == "json_object":
+        schema = embedded_schema(prompt)
+    if schema is not None:
+        content = json.dumps(fake_structured(schema, prompt))
+    else:
+        content = "fake search query"
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": content,
+                "refusal": None
+            },
+            "finish_reason": "stop",
+            "logprobs": None,
+        }],
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": 50,
+            "total_tokens": len(prompt) // 4 + 50
+        },
+    }
+
+
+def create_app(services: dict):
+    app = FastAPI()
+
+    @app.get("/res/v1/web/search")
+    async def brave_search(q: str):
+        return await services["brave"].respond(lambda: brave_results(q))
+
+    @app.post("/v1/messages")
+    async def anthropic_messages(request: Request):
+        body = await request.json()
+        # Anthropic reports overload as 529.
+        return await services["anthropic"].respond(
+            lambda: anthropic_message(body), error_status=529)
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        return await services["openai"].respond(lambda: chat_completion(body))
+
+    @app.post("/openai/v1/chat/completions")
+    async def groq_chat(request: Request):
+        body = await request.json()
+        return await services["groq"].respond(lambda: chat_completion(body))
+
+    @app.get("/stats")
+    async def stats():
+        return {name: service.stats() for name, service in services.items()}
+
+    return app
+
+
+def add_service_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.2,
+                        help="mean seconds per fake provider call")
+    parser.add_argument("--jitter",
+                        type=float,
+                        default=0.1,
+                        help="+/- seconds of uniform latency noise")
+    parser.add_argument("--error-rate",
+                        type=float,
+                        default=0.0,
+                        help="fraction of calls answered with a 5xx")
+    parser.add_argument("--rate-limit",
+                        type=float,
+                        default=0.0,
+                        help="requests per second per service before 429s "
+                        "(0 for none)")
+    for name in ("brave", "anthropic", "openai", "groq"):
+        parser.add_argument(f"--{name}-latency", type=float)
+        parser.add_argument(f"--{name}-error-rate", type=float)
+        parser.add_argument(f"--{name}-rate-limit", type=float)
+
+
+def services_from_args(args: argparse.Namespace):
+    services = {}
+    for name in ("brave", "anthropic", "openai", "groq"):
+
+        def pick(setting: str):
+            value = getattr(args, f"{name}_{setting}")
+            return getattr(args, setting) if value is None else value
+
+        services[name] = FakeService(latency=pick("latency"),
+                                     jitter=args.jitter,
+                                     error_rate=pick("error_rate"),
+                                     rate_limit=pick("rate_limit"))
+    return services
+
+
+class FakeServer:
+    """Runs the fake providers with uvicorn in a background thread."""
+
+    def __init__(self, services: dict, host: str = "127.0.0.1", port: int = 0):
+        self.services = services
+        config = uvicorn.Config(create_app(services),
+                                host=host,
+                                port=port,
+                                log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_service_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(services_from_args(args)),
+                host=args.host,
+                port=args.port)
+
+
+if __name__ == "__main__":
+    main()
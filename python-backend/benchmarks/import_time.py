@@ -0,0 +1,104 @@
+"""Cold start time of the API.
+
+Each run starts a fresh interpreter that imports the app, runs its startup
+and serves one `GET /sheets` request, timing each step and recording which
+provider SDKs got loaded. API keys are removed from the child's environment,
+so it also checks that a worker serving only sheet traffic comes up without
+them.
+
+Run from the python-backend directory:
+
+    python -m benchmarks.import_time --runs 5 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from src.python_backend.main import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    started = time.perf_counter()
+    client.get("/sheets").raise_for_status()
+    served = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "startup": started - imported,
+    "first_request": served - started,
+    "sdks": [name for name in ("anthropic", "openai", "groq", "instructor")
+             if name in sys.modules],
+}))
+"""
+
+KEYS = ("BRAVE_API_KEY", "GROQ_API_KEY", "OPENAI_API_KEY", "ANTHROPIC_API_KEY")
+
+
+def run_child(importtime: bool):
+    env = {key: value for key, value in os.environ.items() if key not in KEYS}
+    env["URL_DATABASE"] = (
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'import_time.db')}")
+    env["PYTHONPATH"] = os.getcwd()
+    args = [sys.executable]
+    if importtime:
+        args += ["-X", "importtime"]
+    start = time.perf_counter()
+    child = subprocess.run(args + ["-c", CHILD],
+                           env=env,
+                           capture_output=True,
+                           text=True,
+                           check=True)
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result, child.stderr
+
+
+def slowest_packages(importtime_output: str, top: int):
+    # Cumulative microseconds of each top-level package, taken from the
+    # first time it was imported.
+    packages = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        package = name.split(".")[0]
+        if name == package and package not in packages:
+            packages[package] = int(cumulative)
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top",
+                        type=int,
+                        default=10,
+                        help="slowest top-level packages to list")
+    args = parser.parse_args()
+
+    # One untimed run so bytecode is compiled and cached.
+    run_child(importtime=False)
+    results = [run_child(importtime=False)[0] for _ in range(args.runs)]
+    for step in ("process", "import", "startup", "first_request"):
+        values = [result[step] * 1000 for result in results]
+        print(f"{step:>14}: median {statistics.median(values):8.1f} ms  "
+              f"min {min(values):8.1f} ms")
+    print(f"{'SDKs loaded':>14}: {', '.join(results[-1]['sdks']) or 'none'}")
+
+    _, importtime_output = run_child(importtime=True)
+    print("\nslowest packages on import:")
+    for package, microseconds in slowest_packages(importtime_output,
+                                                  args.top):
+        print(f"{package:>30} {microseconds / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
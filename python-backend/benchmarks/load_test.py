@@ -0,0 +1,163 @@
+"""Load test for the AI endpoints with the LLM and Brave calls faked out.
+
+Each fake provider call sleeps for a fixed latency, so a server that keeps
+the event loop free should scale throughput roughly linearly with the number
+of concurrent clients, and `/load-sheets` should stay fast while autofills
+are in flight.
+
+Run from the python-backend directory:
+
+    python -m benchmarks.load_test --latency 0.2 --requests 64
+
+Pass `--consolidation batched` to compare against one consolidation call per
+row instead of one per column.
+"""
+import argparse
+import json
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("BRAVE_API_KEY", "load-test")
+os.environ.setdefault("GROQ_API_KEY", "load-test")
+os.environ.setdefault("OPENAI_API_KEY", "load-test")
+os.environ.setdefault("ANTHROPIC_API_KEY", "load-test")
+os.environ.setdefault(
+    "URL_DATABASE",
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load_test.db')}")
+
+import httpx
+
+import src.python_backend.ai_functions as ai_functions
+from src.python_backend.main import app
+from src.python_backend.prompts import (
+    CellFillQueryCreationResponse, CellFillInformationConsolidationResponse,
+    CellFillBatchConsolidationResponse, ColumnSuggestionResponse,
+    IndexColConsolidationResponse)
+
+FAKE_ANSWER = CellFillInformationConsolidationResponse(
+    answer="42", sources=["https://example.com"])
+
+
+def count_batch_cells(prompt: str):
+    return len(json.loads(prompt.rsplit("Here is the input:", 1)[1])["cells"])
+
+
+FAKE_RESPONSES = {
+    CellFillQueryCreationResponse:
+    lambda prompt: CellFillQueryCreationResponse(
+        queries=[f"query {i}" for i in range(32)]),
+    CellFillInformationConsolidationResponse:
+    lambda prompt: FAKE_ANSWER,
+    CellFillBatchConsolidationResponse:
+    lambda prompt: CellFillBatchConsolidationResponse(
+        answers=[FAKE_ANSWER] * count_batch_cells(prompt)),
+    ColumnSuggestionResponse:
+    lambda prompt: ColumnSuggestionResponse(
+        columns=["company_name", "valuation"]),
+    IndexColConsolidationResponse:
+    lambda prompt: IndexColConsolidationResponse(index_values=["Anthropic"]),
+}
+
+llm_usage = {"calls": 0, "prompt_tokens": 0}
+
+
+def install_fakes(latency: float):
+
+    async def fake_llm(prompt, response_format=None, **kwargs):
+        llm_usage["calls"] += 1
+        llm_usage["prompt_tokens"] += ai_functions.estimate_tokens(prompt)
+        await asyncio.sleep(latency)
+        if response_format:
+            return FAKE_RESPONSES[response_format](prompt)
+        return "fake search query"
+
+    async def fake_search(query):
+        await asyncio.sleep(latency)
+        return [{"title": query, "url": "https://example.com"}]
+
+    ai_functions.ask_llm_async = fake_llm
+    ai_functions.search_brave_async = fake_search
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int,
+                    total_requests: int, columns: int, consolidation: str):
+    queue = asyncio.Queue()
+    for i in range(total_requests):
+        queue.put_nowait(i)
+    body = {
+        "description": "I want to investigate startups",
+        "columns": [f"col_{i}" for i in range(columns)],
+        "index_value": "Anthropic",
+        "consolidation": consolidation,
+    }
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            response = await client.post("/autofill-cells", json=body)
+            response.raise_for_status()
+
+    async def probe_load_sheets():
+        start = time.perf_counter()
+        response = await client.get("/load-sheets")
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    await asyncio.sleep(0)
+    probe_latency = await probe_load_sheets()
+    await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - start
+    return total_requests / elapsed, probe_latency
+
+
+async def run(args):
+    install_fakes(args.latency)
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport does not run the lifespan, which sets up the database.
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+            transport=transport, base_url="http://load-test",
+            timeout=None) as client:
+        print(f"{'clients':>8} {'req/s':>10} {'speedup':>8} "
+              f"{'load-sheets ms':>15} {'llm calls/req':>14} "
+              f"{'prompt tokens/req':>18}")
+        baseline = None
+        for concurrency in args.concurrency:
+            llm_usage.update(calls=0, prompt_tokens=0)
+            throughput, probe_latency = await run_level(
+                client, concurrency, args.requests, args.columns,
+                args.consolidation)
+            baseline = baseline or throughput
+            print(f"{concurrency:>8} {throughput:>10.2f} "
+                  f"{throughput / baseline:>8.1f} "
+                  f"{probe_latency * 1000:>15.1f} "
+                  f"{llm_usage['calls'] / args.requests:>14.1f} "
+                  f"{llm_usage['prompt_tokens'] / args.requests:>18.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.2,
+                        help="seconds slept by every fake provider call")
+    parser.add_argument("--requests",
+                        type=int,
+                        default=64,
+                        help="/autofill-cells requests per concurrency level")
+    parser.add_argument("--columns", type=int, default=5)
+    parser.add_argument("--consolidation",
+                        choices=["per_column", "batched"],
+                        default="per_column")
+    parser.add_argument("--concurrency",
+                        type=int,
+                        nargs="+",
+                        default=[1, 2, 4, 8, 16, 32])
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""CPU time per MB of sheet data for the /load-sheets serialization path.
+
+The old path stored columns, data and sources as json.dumps strings inside
+JSON columns, decoded them again on load, and then let FastAPI validate the
+nested dicts against LoadSheetsResponse and run them through
+jsonable_encoder before rendering. The new path renders the plain sheet
+dicts once with FastJSONResponse, using orjson when it is installed.
+
+Run from the python-backend directory:
+
+    python -m benchmarks.serialization --sheets 20 --rows 500 --cols 12
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault("BRAVE_API_KEY", "benchmark")
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+os.environ.setdefault(
+    "URL_DATABASE",
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import Dict, List
+
+import src.python_backend.serialization as serialization
+from src.python_backend.serialization import FastJSONResponse
+
+
+class LoadSheetsResponse(BaseModel):
+    sheets: List[Dict]
+
+
+def make_sheets(sheet_count: int, rows: int, cols: int):
+    sheets = []
+    for i in range(sheet_count):
+        columns = [f"column_{col}" for col in range(cols)]
+        data = [[f"value {row}-{col} with some text" for col in range(cols)]
+                for row in range(rows)]
+        sources = [[f"https://example.com/{row}/{col}" for col in range(cols)]
+                   for row in range(rows)]
+        sheets.append({
+            "id": str(i),
+            "title": f"Sheet {i}",
+            "description": "Benchmark sheet",
+            "indexColumn": columns[0],
+            "columns": columns,
+            "data": data,
+            "sources": sources,
+            "version": 0,
+        })
+    return sheets
+
+
+def old_path(sheets):
+    # What save_sheet wrote and load_sheets read back before.
+    stored = [{
+        **sheet, "columns": json.dumps(sheet["columns"]),
+        "data": json.dumps(sheet["data"]),
+        "sources": json.dumps(sheet["sources"])
+    } for sheet in sheets]
+    loaded = [{
+        "id": sheet["id"],
+        "sheet": {
+            **sheet, "columns": json.loads(sheet["columns"]),
+            "data": json.loads(sheet["data"]),
+            "sources": json.loads(sheet["sources"])
+        }
+    } for sheet in stored]
+    response = LoadSheetsResponse.model_validate(
+        LoadSheetsResponse(sheets=loaded).model_dump())
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def new_path(sheets):
+    payload = {"sheets": [{"id": sheet["id"], "sheet": sheet}
+                          for sheet in sheets]}
+    return FastJSONResponse(payload).body
+
+
+def measure(fn, sheets, repeat: int):
+    body = fn(sheets)
+    start = time.process_time()
+    for _ in range(repeat):
+        fn(sheets)
+    elapsed = (time.process_time() - start) / repeat
+    megabytes = len(body) / 1_000_000
+    return elapsed, megabytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sheets", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sheets = make_sheets(args.sheets, args.rows, args.cols)
+    paths = [("old (double encode + validate)", old_path),
+             ("new (stdlib json)", new_path)]
+    orjson = serialization.orjson
+    if orjson is not None:
+        paths.append(("new (orjson)", new_path))
+
+    for name, fn in paths:
+        serialization.orjson = orjson if name == "new (orjson)" else None
+        elapsed, megabytes = measure(fn, sheets, args.repeat)
+        print(f"{name:32} {megabytes:6.2f} MB  "
+              f"{elapsed * 1000:8.1f} ms  "
+              f"{elapsed * 1000 / megabytes:8.1f} ms CPU/MB")
+    serialization.orjson = orjson
+    if orjson is None:
+        print("orjson is not installed; `pip install orjson` to compare it")
+
+
+if __name__ == "__main__":
+    main()
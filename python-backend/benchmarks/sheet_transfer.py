@@ -0,0 +1,127 @@
+"""Memory use of streaming sheet import and export.
+
+Starts the API with uvicorn in a child process on a fresh SQLite database,
+streams a generated CSV of --rows rows into POST /sheets/{id}/import, reads
+it back through GET /sheets/{id}/export in each format and finally through
+GET /sheets/{id}, which builds the whole sheet in memory. After each step
+the server's resident and peak memory are read from /proc, so this needs
+Linux.
+
+Run from the python-backend directory:
+
+    python -m benchmarks.sheet_transfer --rows 200000 --columns 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+SHEET_ID = "sheet-transfer-benchmark"
+
+
+def memory_mb(pid: int):
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0]) / 1024
+    return values["VmRSS"], values["VmHWM"]
+
+
+def generate_csv(rows: int, columns: int, chunk_rows: int = 1000):
+    yield (",".join(["company"] + [f"col_{c}" for c in range(columns - 1)]) +
+           "\n").encode()
+    for start in range(0, rows, chunk_rows):
+        yield "".join(
+            ",".join([f"Company {r}"] + [
+                f"research notes for company {r} column {c}"
+                for c in range(columns - 1)
+            ]) + "\n"
+            for r in range(start, min(rows, start + chunk_rows))).encode()
+
+
+def start_server(port: int):
+    env = dict(os.environ)
+    env["URL_DATABASE"] = (
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'sheet_transfer.db')}")
+    env["PYTHONPATH"] = os.getcwd()
+    env.setdefault("LOG_LEVEL", "ERROR")
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "src.python_backend.main:app",
+        "--port",
+        str(port), "--log-level", "warning"
+    ],
+                              env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            httpx.get(f"{base_url}/")
+            return server, base_url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Server did not start")
+
+
+def report(step: str, pid: int, start: float, size: int, baseline: float):
+    elapsed = time.perf_counter() - start
+    rss, peak = memory_mb(pid)
+    print(f"{step:>24} {size / 1e6:9.1f} {elapsed:8.2f} "
+          f"{size / 1e6 / elapsed:8.1f} {rss:9.1f} {peak - baseline:10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port)
+    try:
+        _, baseline = memory_mb(server.pid)
+        print(f"idle peak RSS {baseline:.1f} MB")
+        print(f"{'step':>24} {'MB':>9} {'seconds':>8} {'MB/s':>8} "
+              f"{'RSS MB':>9} {'peak +MB':>10}")
+        with httpx.Client(base_url=base_url, timeout=None) as client:
+            size = 0
+
+            def counted():
+                nonlocal size
+                for chunk in generate_csv(args.rows, args.columns):
+                    size += len(chunk)
+                    yield chunk
+
+            start = time.perf_counter()
+            client.post(f"/sheets/{SHEET_ID}/import",
+                        content=counted()).raise_for_status()
+            report("import csv", server.pid, start, size, baseline)
+
+            for format in ("csv", "ndjson"):
+                start = time.perf_counter()
+                size = 0
+                with client.stream("GET",
+                                   f"/sheets/{SHEET_ID}/export",
+                                   params={"format": format}) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_bytes():
+                        size += len(chunk)
+                report(f"export {format}", server.pid, start, size, baseline)
+
+            start = time.perf_counter()
+            response = client.get(f"/sheets/{SHEET_ID}")
+            response.raise_for_status()
+            report("GET /sheets/{id}", server.pid, start,
+                   len(response.content), baseline)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Offline benchmark of the API against local fake providers.
+
+Starts benchmarks.fake_providers on a free local port, points the Brave
+search URL and the LLM SDK base URLs at it, and drives /autofill-cells,
+/autofill-index, /save-sheet and /load-sheets in-process at each
+concurrency level, reporting p50/p95/p99 latency, throughput and errors.
+No network access or API keys are needed.
+
+Run from the python-backend directory:
+
+    python -m benchmarks.suite --concurrency 1 8 32 --requests 64
+
+Results can be saved with --output and compared to a saved run with
+--baseline; the run exits with status 1 if p95 latency or throughput got
+worse than --tolerance allows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_providers import FakeServer, add_service_arguments, services_from_args
+
+SCENARIOS = ("autofill-cells", "autofill-index", "save-sheet", "load-sheets")
+
+
+def configure_environment(base_url: str, use_cache: bool):
+    os.environ["BRAVE_SEARCH_URL"] = f"{base_url}/res/v1/web/search"
+    os.environ["ANTHROPIC_BASE_URL"] = base_url
+    os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+    os.environ["GROQ_BASE_URL"] = base_url
+    for key in ("BRAVE_API_KEY", "GROQ_API_KEY", "OPENAI_API_KEY",
+                "ANTHROPIC_API_KEY"):
+        os.environ.setdefault(key, "benchmark")
+    os.environ.setdefault(
+        "URL_DATABASE",
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}")
+    if not use_cache:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        os.environ["SEARCH_CACHE_TTL"] = "0"
+    # Injected errors would otherwise log a warning for every failed cell.
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    # The backend's own client-side rate limits would otherwise dominate;
+    # set them explicitly to benchmark with them.
+    for provider in ("BRAVE", "ANTHROPIC", "OPENAI", "GROQ"):
+        os.environ.setdefault(f"{provider}_RATE_LIMIT", "0")
+
+
+def percentile(values, fraction: float):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def make_sheet(i: int, rows: int, columns: int):
+    return {
+        "id": f"benchmark-{i}",
+        "title": f"Benchmark sheet {i}",
+        "description": "I want to investigate startups",
+        "indexColumn": "company",
+        "columns": ["company"] + [f"col_{c}" for c in range(columns - 1)],
+        "data": [[f"Company {r}"] + [f"value {r}-{c}" for c in range(columns - 1)]
+                 for r in range(rows)],
+        "sources": [["" for _ in range(columns)] for _ in range(rows)],
+    }
+
+
+def make_request(scenario: str, i: int, args: argparse.Namespace):
+    # Inputs vary per request so caches and in-flight deduplication do not
+    # hide provider latency.
+    if scenario == "autofill-cells":
+        return "POST", "/autofill-cells", {
+            "description": "I want to investigate startups",
+            "columns": [f"col_{c}" for c in range(args.columns)],
+            "index_value": f"Company {i}",
+            "consolidation": args.consolidation,
+        }
+    if scenario == "autofill-index":
+        return "POST", "/autofill-index", {
+            "description": f"I want to investigate startups, batch {i}",
+            "col_name": "company",
+            "max_count": 10,
+        }
+    if scenario == "save-sheet":
+        sheet = make_sheet(i % args.sheets, args.rows, args.columns)
+        return "POST", "/save-sheet", {"id": sheet["id"], "sheet": sheet}
+    return "GET", "/load-sheets", None
+
+
+async def run_scenario(client, scenario: str, concurrency: int,
+                       args: argparse.Namespace):
+    latencies = []
+    errors = 0
+    next_request = iter(range(args.requests))
+
+    async def worker():
+        nonlocal errors
+        for i in next_request:
+            method, path, body = make_request(scenario, i, args)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                response.raise_for_status()
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "errors": errors,
+        "throughput": args.requests / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+async def run(args: argparse.Namespace):
+    import httpx
+    from src.python_backend.main import app
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport does not run the lifespan, which sets up the database.
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark",
+            timeout=None) as client:
+        # /load-sheets reads whatever is saved, so seed it first.
+        for i in range(args.sheets):
+            sheet = make_sheet(i, args.rows, args.columns)
+            await client.post("/save-sheet",
+                              json={
+                                  "id": sheet["id"],
+                                  "sheet": sheet
+                              })
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                result = await run_scenario(client, scenario, concurrency,
+                                            args)
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def print_header():
+    print(f"{'scenario':>15} {'clients':>8} {'req/s':>9} {'p50 ms':>9} "
+          f"{'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+
+
+def print_result(result):
+    print(f"{result['scenario']:>15} {result['concurrency']:>8} "
+          f"{result['throughput']:>9.2f} {result['p50'] * 1000:>9.1f} "
+          f"{result['p95'] * 1000:>9.1f} {result['p99'] * 1000:>9.1f} "
+          f"{result['errors']:>7}")
+
+
+def compare(results, baseline, tolerance: float):
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        if result["p95"] > before["p95"] * (1 + tolerance):
+            regressions.append(
+                f"{result['scenario']} x{result['concurrency']}: p95 "
+                f"{before['p95'] * 1000:.1f} -> {result['p95'] * 1000:.1f} ms")
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{result['scenario']} x{result['concurrency']}: throughput "
+                f"{before['throughput']:.2f} -> {result['throughput']:.2f} "
+                "req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios",
+                        nargs="+",
+                        choices=SCENARIOS,
+                        default=list(SCENARIOS))
+    parser.add_argument("--concurrency",
+                        type=int,
+                        nargs="+",
+                        default=[1, 8, 32])
+    parser.add_argument("--requests",
+                        type=int,
+                        default=64,
+                        help="requests per scenario and concurrency level")
+    parser.add_argument("--columns", type=int, default=5)
+    parser.add_argument("--rows",
+                        type=int,
+                        default=100,
+                        help="rows per saved sheet")
+    parser.add_argument("--sheets",
+                        type=int,
+                        default=10,
+                        help="sheets saved before the run")
+    parser.add_argument("--consolidation",
+                        choices=["per_column", "batched"],
+                        default="per_column")
+    parser.add_argument("--use-cache",
+                        action="store_true",
+                        help="keep the LLM and search caches enabled")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline",
+                        help="compare against results saved with --output")
+    parser.add_argument("--tolerance",
+                        type=float,
+                        default=0.1,
+                        help="allowed relative regression against baseline")
+    add_service_arguments(parser)
+    args = parser.parse_args()
+
+    with FakeServer(services_from_args(args)) as server:
+        configure_environment(server.url, args.use_cache)
+        print_header()
+        results = asyncio.run(run(args))
+        print(f"fake providers: {json.dumps({n: s.stats() for n, s in server.services.items()})}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
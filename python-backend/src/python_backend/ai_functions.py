@@ -1,104 +1,552 @@
-from src.python_backend.brave import search_brave
+from src.python_backend.brave import search_brave, search_brave_async
+from src.python_backend.compaction import compact_for_prompt, estimate_tokens
 from src.python_backend.prompts import (
     CELL_FILL_QUERY_CREATION_PROMPT,
     CELL_FILL_INFORMATION_CONSOLIDATION_PROMPT, 
+    CELL_FILL_BATCH_CONSOLIDATION_PROMPT,
     COLUMN_SUGGESTION_PROMPT,
     INDEX_COL_QUERY_CREATION_PROMPT,
     INDEX_COL_CONSOLIDATION_PROMPT,
     CellFillQueryCreationResponse,
     CellFillInformationConsolidationResponse,
+    CellFillBatchConsolidationResponse,
     ColumnSuggestionResponse,
     IndexColConsolidationResponse
 )
-from src.python_backend.llm import ASK_LLM
-from typing import List
+from src.python_backend.llm import ask_llm, ask_llm_async
+from src.python_backend.metrics import counter
+from src.python_backend.resilience import ProviderNotConfiguredError
+from src.python_backend.scheduler import Scheduler, autofill_scheduler
+from src.python_backend.tracing import span
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
 import json
+import logging
+import os
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
 
-def get_queries_to_search(selected_cols: List[str], index_value: str,
-                          description: str):
+AUTOFILL_MAX_CONCURRENCY = int(os.getenv("AUTOFILL_MAX_CONCURRENCY", "8"))
+
+# "per_column" makes one consolidation call per cell, "batched" one per row.
+CONSOLIDATION_MODES = ("per_column", "batched")
+AUTOFILL_CONSOLIDATION_MODE = os.getenv("AUTOFILL_CONSOLIDATION_MODE",
+                                        "per_column")
+if AUTOFILL_CONSOLIDATION_MODE not in CONSOLIDATION_MODES:
+    raise ValueError(
+        f"Unknown AUTOFILL_CONSOLIDATION_MODE: {AUTOFILL_CONSOLIDATION_MODE}")
+# Rows whose batched prompt is estimated above this fall back to per-column
+# calls, which each only carry one cell's search results.
+BATCH_CONSOLIDATION_MAX_TOKENS = int(
+    os.getenv("BATCH_CONSOLIDATION_MAX_TOKENS", "60000"))
+
+
+def record_consolidation(mode: str, prompt: str):
+    counter("autofill_consolidation_calls",
+            "Consolidation LLM calls",
+            mode=mode).inc()
+    counter("autofill_consolidation_prompt_tokens",
+            "Estimated prompt tokens sent for consolidation",
+            mode=mode).inc(estimate_tokens(prompt))
+
+
+def get_queries_prompt(selected_cols: List[str], index_value: str,
+                       description: str):
     input_dict = {
         "description": description,
         "columns": selected_cols,
         "index_value": index_value
     }
-    prompt = CELL_FILL_QUERY_CREATION_PROMPT.format(
+    return CELL_FILL_QUERY_CREATION_PROMPT.format(
         current_date=datetime.now().strftime("%Y-%m-%d"),
         input_dict=json.dumps(input_dict))
-    openai_output: CellFillQueryCreationResponse = ASK_LLM(
-        prompt, response_format=CellFillQueryCreationResponse)
-    return {
-        col_name: query
-        for col_name, query in zip(selected_cols, openai_output.queries)
-    }
 
 
-def consolidate_search_results(description: str, element: str, aspect: str,
-                               query: str, search_results: str):
+def get_consolidation_prompt(description: str, element: str, aspect: str,
+                             query: str, search_results: str):
     input_dict = {
         "description": description,
         "element": element,
         "aspect": aspect,
         "query": query,
     }
-    prompt = CELL_FILL_INFORMATION_CONSOLIDATION_PROMPT.format(
+    return CELL_FILL_INFORMATION_CONSOLIDATION_PROMPT.format(
         current_date=datetime.now().strftime("%Y-%m-%d"),
         input_dict=json.dumps(input_dict),
-        search_results=search_results)
-    return ASK_LLM(prompt,
-                   response_format=CellFillInformationConsolidationResponse)
+        search_results=compact_for_prompt(query, search_results))
+
+
+def get_batch_consolidation_prompt(description: str, element: str,
+                                   cells: List[Tuple[str, str, Any]]):
+    input_dict = {
+        "description":
+        description,
+        "element":
+        element,
+        "cells": [{
+            "aspect": aspect,
+            "query": query,
+            "search_results": compact_for_prompt(query, search_results)
+        } for aspect, query, search_results in cells],
+    }
+    return CELL_FILL_BATCH_CONSOLIDATION_PROMPT.format(
+        current_date=datetime.now().strftime("%Y-%m-%d"),
+        input_dict=json.dumps(input_dict))
+
+
+def get_queries_to_search(selected_cols: List[str], index_value: str,
+                          description: str):
+    prompt = get_queries_prompt(selected_cols, index_value, description)
+    with span("generate_queries", columns=len(selected_cols)):
+        openai_output: CellFillQueryCreationResponse = ask_llm(
+            prompt, response_format=CellFillQueryCreationResponse)
+    return {
+        col_name: query
+        for col_name, query in zip(selected_cols, openai_output.queries)
+    }
+
+
+async def get_queries_to_search_async(selected_cols: List[str],
+                                      index_value: str, description: str):
+    prompt = get_queries_prompt(selected_cols, index_value, description)
+    with span("generate_queries", columns=len(selected_cols)):
+        openai_output: CellFillQueryCreationResponse = await ask_llm_async(
+            prompt, response_format=CellFillQueryCreationResponse)
+    return {
+        col_name: query
+        for col_name, query in zip(selected_cols, openai_output.queries)
+    }
+
+
+def consolidate_search_results(description: str, element: str, aspect: str,
+                               query: str, search_results: str):
+    prompt = get_consolidation_prompt(description, element, aspect, query,
+                                      search_results)
+    record_consolidation("per_column", prompt)
+    with span("consolidate", mode="per_column"):
+        return ask_llm(
+            prompt, response_format=CellFillInformationConsolidationResponse)
+
+
+async def consolidate_search_results_async(description: str,
+                                           element: str,
+                                           aspect: str,
+                                           query: str,
+                                           search_results: str,
+                                           use_cache: bool = True):
+    prompt = get_consolidation_prompt(description, element, aspect, query,
+                                      search_results)
+    record_consolidation("per_column", prompt)
+    with span("consolidate", mode="per_column"):
+        return await ask_llm_async(
+            prompt,
+            response_format=CellFillInformationConsolidationResponse,
+            use_cache=use_cache)
+
+
+def check_batch_answers(response: CellFillBatchConsolidationResponse,
+                        cells: List[Tuple[str, str, Any]]):
+    if len(response.answers) != len(cells):
+        logger.warning(
+            "Batched consolidation returned %d answers for %d cells, "
+            "falling back", len(response.answers), len(cells))
+        return None
+    return response.answers
+
+
+def consolidate_row_batched(description: str, index_value: str,
+                            cells: List[Tuple[str, str, Any]]):
+    # Returns None when the row should be consolidated per column instead.
+    prompt = get_batch_consolidation_prompt(description, index_value, cells)
+    if estimate_tokens(prompt) > BATCH_CONSOLIDATION_MAX_TOKENS:
+        return None
+    record_consolidation("batched", prompt)
+    try:
+        with span("consolidate", mode="batched", cells=len(cells)):
+            response = ask_llm(
+                prompt, response_format=CellFillBatchConsolidationResponse)
+    except Exception as e:
+        logger.warning("Error consolidating %s in one call: %s", index_value,
+                       e)
+        return None
+    return check_batch_answers(response, cells)
+
+
+async def consolidate_row_batched_async(description: str, index_value: str,
+                                        cells: List[Tuple[str, str, Any]]):
+    prompt = get_batch_consolidation_prompt(description, index_value, cells)
+    if estimate_tokens(prompt) > BATCH_CONSOLIDATION_MAX_TOKENS:
+        return None
+    record_consolidation("batched", prompt)
+    try:
+        with span("consolidate", mode="batched", cells=len(cells)):
+            response = await ask_llm_async(
+                prompt, response_format=CellFillBatchConsolidationResponse)
+    except Exception as e:
+        logger.warning("Error consolidating %s in one call: %s", index_value,
+                       e)
+        return None
+    return check_batch_answers(response, cells)
+
+
+def autofill_row_batched(description: str, index_value: str,
+                         query_dict: Dict[str, str]):
+    searched = []
+    for col_name, query in query_dict.items():
+        try:
+            searched.append((col_name, query, search_brave(query)))
+        except ProviderNotConfiguredError:
+            raise
+        except Exception as e:
+            logger.warning("Error searching %s for %s: %s", col_name,
+                           index_value, e)
+    answers = consolidate_row_batched(description, index_value,
+                                      searched) if searched else []
+    if answers is None:
+        answers = []
+        for col_name, query, search_results in searched:
+            try:
+                answers.append(
+                    consolidate_search_results(description, col_name,
+                                               index_value, query,
+                                               search_results))
+            except Exception as e:
+                logger.warning("Error processing %s for %s: %s", col_name,
+                               index_value, e)
+                answers.append(None)
+    return cells_from_answers(query_dict, searched, answers)
+
+
+async def autofill_row_batched_async(description: str, index_value: str,
+                                     query_dict: Dict[str, str],
+                                     scheduler: Scheduler):
+    search_results = await asyncio.gather(*[
+        scheduler.run(search_brave_async, query)
+        for query in query_dict.values()
+    ], return_exceptions=True)
+    searched = []
+    for (col_name, query), results in zip(query_dict.items(), search_results):
+        if isinstance(results, ProviderNotConfiguredError):
+            raise results
+        if isinstance(results, Exception):
+            logger.warning("Error searching %s for %s: %s", col_name,
+                           index_value, results)
+        else:
+            searched.append((col_name, query, results))
+    answers = await consolidate_row_batched_async(
+        description, index_value, searched) if searched else []
+    if answers is None:
+        answers = await asyncio.gather(*[
+            scheduler.run(consolidate_search_results_async, description,
+                          col_name, index_value, query, results)
+            for col_name, query, results in searched
+        ], return_exceptions=True)
+        for (col_name, _, _), answer in zip(searched, answers):
+            if isinstance(answer, Exception):
+                logger.warning("Error processing %s for %s: %s", col_name,
+                               index_value, answer)
+    return cells_from_answers(query_dict, searched, answers)
 
 
-def ai_autofill_cells(selected_cols: List[str], index_value: str,
-                      description: str):
+def cells_from_answers(query_dict: Dict[str, str],
+                       searched: List[Tuple[str, str, Any]],
+                       answers: List[Optional[Any]]):
+    # Maps each column to its (value, source), "unknown" where the search or
+    # the consolidation failed.
+    cells = {col_name: ("unknown", "unknown") for col_name in query_dict}
+    for (col_name, _, _), answer in zip(searched, answers):
+        if isinstance(answer, CellFillInformationConsolidationResponse):
+            cells[col_name] = (answer.answer, "\n".join(answer.sources))
+    return cells
+
+
+def ai_autofill_cells(selected_cols: List[str],
+                      index_value: str,
+                      description: str,
+                      consolidation: Optional[str] = None):
     query_dict = get_queries_to_search(selected_cols, index_value, description)
+    if (consolidation or AUTOFILL_CONSOLIDATION_MODE) == "batched":
+        cells = autofill_row_batched(description, index_value, query_dict)
+        return ([value for value, _ in cells.values()],
+                [source for _, source in cells.values()])
     results = []
     sources = []
     for col_name, query in query_dict.items():
-        print(f"Processing {col_name} for {index_value}")
-        print(f"Query: {query}")
+        logger.debug("Processing %s for %s, query: %s", col_name, index_value,
+                     query)
         try:
-            search_results = search_brave(query)
-            consolidation_response: CellFillInformationConsolidationResponse = consolidate_search_results(
-                description, col_name, index_value, query, search_results)
+            with span("autofill_cell"):
+                search_results = search_brave(query)
+                consolidation_response: CellFillInformationConsolidationResponse = consolidate_search_results(
+                    description, col_name, index_value, query, search_results)
             results.append(consolidation_response.answer)
             sources.append("\n".join(consolidation_response.sources))
+        except ProviderNotConfiguredError:
+            raise
         except Exception as e:
-            print(f"Error processing {col_name} for {index_value}: {e}")
+            logger.warning("Error processing %s for %s: %s", col_name,
+                           index_value, e)
             results.append("unknown")
             sources.append("unknown")
     return results, sources
 
 
-def ai_autofill_index_col(description: str,
-                          col_name: str,
-                          max_count: int = 10):
+async def research_cell_async(description: str,
+                              col_name: str,
+                              index_value: str,
+                              query: str,
+                              use_cache: bool = True):
+    # Raises on search or consolidation errors; autofill jobs record them
+    # as failed tasks instead of writing "unknown" into the sheet. Without
+    # use_cache both the search and the answer are fetched anew.
+    logger.debug("Processing %s for %s, query: %s", col_name, index_value,
+                 query)
+    with span("autofill_cell"):
+        search_results = await search_brave_async(query, use_cache)
+        consolidation_response: CellFillInformationConsolidationResponse = await consolidate_search_results_async(
+            description, col_name, index_value, query, search_results,
+            use_cache)
+    return consolidation_response.answer, "\n".join(
+        consolidation_response.sources)
+
+
+async def autofill_cell_async(description: str, col_name: str,
+                              index_value: str, query: str):
+    try:
+        return await research_cell_async(description, col_name, index_value,
+                                         query)
+    except ProviderNotConfiguredError:
+        raise
+    except Exception as e:
+        logger.warning("Error processing %s for %s: %s", col_name,
+                       index_value, e)
+        return "unknown", "unknown"
+
+
+async def ai_autofill_cells_async(
+        selected_cols: List[str],
+        index_value: str,
+        description: str,
+        max_concurrency: int = AUTOFILL_MAX_CONCURRENCY,
+        consolidation: Optional[str] = None):
+    query_dict = await get_queries_to_search_async(selected_cols, index_value,
+                                                   description)
+    row_scheduler = Scheduler(max_concurrency)
+    if (consolidation or AUTOFILL_CONSOLIDATION_MODE) == "batched":
+        cells = await autofill_row_batched_async(description, index_value,
+                                                 query_dict, row_scheduler)
+        return ([value for value, _ in cells.values()],
+                [source for _, source in cells.values()])
+    cells = await asyncio.gather(*[
+        row_scheduler.run(autofill_cell_async, description, col_name,
+                          index_value, query)
+        for col_name, query in query_dict.items()
+    ])
+    results = [value for value, _ in cells]
+    sources = [source for _, source in cells]
+    return results, sources
+
+
+async def ai_autofill_cells_stream(
+        selected_cols: List[str],
+        index_value: str,
+        description: str,
+        max_concurrency: int = AUTOFILL_MAX_CONCURRENCY,
+        consolidation: Optional[str] = None):
+    query_dict = await get_queries_to_search_async(selected_cols, index_value,
+                                                   description)
+    row_scheduler = Scheduler(max_concurrency)
+    if (consolidation or AUTOFILL_CONSOLIDATION_MODE) == "batched":
+        # One call answers the whole row, so cells arrive together.
+        cells = await autofill_row_batched_async(description, index_value,
+                                                 query_dict, row_scheduler)
+        for col, col_name in enumerate(selected_cols):
+            yield (col, *cells.get(col_name, ("unknown", "unknown")))
+        return
+
+    async def fill_cell(col: int, query: str):
+        value, source = await row_scheduler.run(autofill_cell_async,
+                                                description,
+                                                selected_cols[col],
+                                                index_value, query)
+        return col, value, source
+
+    cell_tasks = []
+    for col, col_name in enumerate(selected_cols):
+        if col_name in query_dict:
+            cell_tasks.append(
+                asyncio.create_task(fill_cell(col, query_dict[col_name])))
+        else:
+            yield col, "unknown", "unknown"
+    try:
+        for next_cell in asyncio.as_completed(cell_tasks):
+            yield await next_cell
+    finally:
+        for task in cell_tasks:
+            task.cancel()
+
+
+async def ai_autofill_sheet_async(selected_cols: List[str],
+                                  index_values: List[str],
+                                  description: str,
+                                  consolidation: Optional[str] = None):
+    completed = asyncio.Queue()
+    batched = (consolidation or AUTOFILL_CONSOLIDATION_MODE) == "batched"
+
+    # Every cell puts exactly one result on the queue, "unknown" when it
+    # fails, or the stream below would wait for it forever.
+    async def fill_cell(row: int, col: int, index_value: str, query: str):
+        try:
+            value, source = await autofill_scheduler.run(
+                autofill_cell_async, description, selected_cols[col],
+                index_value, query)
+        except Exception as e:
+            logger.warning("Error filling %s for %s: %s", selected_cols[col],
+                           index_value, e)
+            value, source = "unknown", "unknown"
+        completed.put_nowait((row, col, value, source))
+
+    async def fill_row(row: int, index_value: str):
+        try:
+            query_dict = await autofill_scheduler.run(
+                get_queries_to_search_async, selected_cols, index_value,
+                description)
+        except Exception as e:
+            logger.warning("Error creating queries for %s: %s", index_value,
+                           e)
+            query_dict = {}
+        if batched and query_dict:
+            try:
+                cells = await autofill_row_batched_async(
+                    description, index_value, query_dict, autofill_scheduler)
+            except Exception as e:
+                logger.warning("Error filling row %s: %s", index_value, e)
+                cells = {}
+            for col, col_name in enumerate(selected_cols):
+                completed.put_nowait(
+                    (row, col, *cells.get(col_name, ("unknown", "unknown"))))
+            return
+        cell_tasks = []
+        for col, col_name in enumerate(selected_cols):
+            if col_name in query_dict:
+                cell_tasks.append(
+                    fill_cell(row, col, index_value, query_dict[col_name]))
+            else:
+                completed.put_nowait((row, col, "unknown", "unknown"))
+        await asyncio.gather(*cell_tasks)
+
+    row_tasks = [
+        asyncio.create_task(fill_row(row, index_value))
+        for row, index_value in enumerate(index_values)
+    ]
+    try:
+        for _ in range(len(index_values) * len(selected_cols)):
+            yield await completed.get()
+    finally:
+        for task in row_tasks:
+            task.cancel()
+
+
+def get_index_query_prompt(description: str, col_name: str):
     input_dict = {"description": description, "col_name": col_name}
-    prompt = INDEX_COL_QUERY_CREATION_PROMPT.format(
+    return INDEX_COL_QUERY_CREATION_PROMPT.format(
         input_dict=json.dumps(input_dict))
-    search_query = ASK_LLM(prompt)
+
+
+def get_index_consolidation_prompt(description: str, col_name: str,
+                                   search_query: str, search_results: str):
     input_dict = {
         "description": description,
         "col_name": col_name,
         "query": search_query
     }
+    return INDEX_COL_CONSOLIDATION_PROMPT.format(
+        input_dict=json.dumps(input_dict), search_results=search_results)
+
+
+def ai_autofill_index_col(description: str,
+                          col_name: str,
+                          max_count: int = 10):
+    prompt = get_index_query_prompt(description, col_name)
+    with span("index_query"):
+        search_query = ask_llm(prompt)
     try:
         search_results = search_brave(search_query)
+    except ProviderNotConfiguredError:
+        raise
     except Exception as e:
-        print(f"Error searching brave: {e}")
+        logger.warning("Error searching brave: %s", e)
         return []
-    consolidation_prompt = INDEX_COL_CONSOLIDATION_PROMPT.format(
-        input_dict=json.dumps(input_dict), search_results=search_results)
-    consolidation_response: IndexColConsolidationResponse = ASK_LLM(
-        consolidation_prompt, response_format=IndexColConsolidationResponse)
+    consolidation_prompt = get_index_consolidation_prompt(
+        description, col_name, search_query, search_results)
+    with span("index_consolidate"):
+        consolidation_response: IndexColConsolidationResponse = ask_llm(
+            consolidation_prompt,
+            response_format=IndexColConsolidationResponse)
+    return consolidation_response.index_values[:max_count]
+
+
+async def ai_autofill_index_col_async(description: str,
+                                      col_name: str,
+                                      max_count: int = 10):
+    prompt = get_index_query_prompt(description, col_name)
+    with span("index_query"):
+        search_query = await ask_llm_async(prompt)
+    try:
+        search_results = await search_brave_async(search_query)
+    except ProviderNotConfiguredError:
+        raise
+    except Exception as e:
+        logger.warning("Error searching brave: %s", e)
+        return []
+    consolidation_prompt = get_index_consolidation_prompt(
+        description, col_name, search_query, search_results)
+    with span("index_consolidate"):
+        consolidation_response: IndexColConsolidationResponse = await ask_llm_async(
+            consolidation_prompt,
+            response_format=IndexColConsolidationResponse)
     return consolidation_response.index_values[:max_count]
 
 
+async def ai_autofill_index_col_stream(description: str,
+                                       col_name: str,
+                                       max_count: int = 10):
+    prompt = get_index_query_prompt(description, col_name)
+    with span("index_query"):
+        search_query = await ask_llm_async(prompt)
+    yield {"event": "query", "query": search_query}
+    try:
+        search_results = await search_brave_async(search_query)
+    except ProviderNotConfiguredError:
+        raise
+    except Exception as e:
+        logger.warning("Error searching brave: %s", e)
+        return
+    consolidation_prompt = get_index_consolidation_prompt(
+        description, col_name, search_query, search_results)
+    with span("index_consolidate"):
+        consolidation_response: IndexColConsolidationResponse = await ask_llm_async(
+            consolidation_prompt,
+            response_format=IndexColConsolidationResponse)
+    for index, value in enumerate(
+            consolidation_response.index_values[:max_count]):
+        yield {"event": "value", "index": index, "value": value}
+
+
 def ai_get_suggested_columns(description: str):
     prompt = COLUMN_SUGGESTION_PROMPT.format(description=description)
-    openai_output: ColumnSuggestionResponse = ASK_LLM(
-        prompt, response_format=ColumnSuggestionResponse)
+    with span("suggest_columns"):
+        openai_output: ColumnSuggestionResponse = ask_llm(
+            prompt, response_format=ColumnSuggestionResponse)
+    return openai_output.columns
+
+
+async def ai_get_suggested_columns_async(description: str):
+    prompt = COLUMN_SUGGESTION_PROMPT.format(description=description)
+    with span("suggest_columns"):
+        openai_output: ColumnSuggestionResponse = await ask_llm_async(
+            prompt, response_format=ColumnSuggestionResponse)
     return openai_output.columns
 
 def run_tests():
@@ -134,4 +582,15 @@ def run_tests():
         pprint({
             "results": results,
             "sources": sources
+        })
+
+    def _test_ai_autofill_cells_async():
+        results, sources = asyncio.run(
+            ai_autofill_cells_async(
+                selected_cols=["valuation", "number_of_employees"],
+                index_value="Anthropic",
+                description="I want to investigate startups"))
+        pprint({
+            "results": results,
+            "sources": sources
         })
\ No newline at end of file
@@ -1,13 +1,40 @@
+from functools import cache
 from typing import Dict
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 import os
 from dotenv import load_dotenv
+from src.python_backend.cache import TTLCache, content_key, normalize_query
+from src.python_backend.metrics import counter
+from src.python_backend.resilience import ProviderNotConfiguredError, policy_from_env
+from src.python_backend.singleflight import SingleFlight
+from src.python_backend.tracing import span
 
 load_dotenv()
 
-BRAVE_API_KEY = os.getenv("BRAVE_API_KEY", None)
-if BRAVE_API_KEY is None:
-    raise ValueError("BRAVE_API_KEY environment variable is required")
+BRAVE_SEARCH_URL = os.getenv("BRAVE_SEARCH_URL",
+                             "https://api.search.brave.com/res/v1/web/search")
+BRAVE_TIMEOUT = float(os.getenv("BRAVE_TIMEOUT", "10"))
+BRAVE_MAX_CONNECTIONS = int(os.getenv("BRAVE_MAX_CONNECTIONS", "50"))
+
+# Rate limit, retry and circuit breaker settings, overridable with
+# BRAVE_RATE_LIMIT, BRAVE_MAX_ATTEMPTS, etc.
+brave_policy = policy_from_env(
+    "brave",
+    rate_limit=20,
+    retry_on=(requests.ConnectionError, requests.Timeout,
+              httpx.TransportError))
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "86400"))
+SEARCH_CACHE_MAXSIZE = int(os.getenv("SEARCH_CACHE_MAXSIZE", "2048"))
+SEARCH_CACHE_PERSIST = os.getenv("SEARCH_CACHE_PERSIST",
+                                 "false").lower() in ("1", "true", "yes")
+
+search_cache = TTLCache(maxsize=SEARCH_CACHE_MAXSIZE, ttl=SEARCH_CACHE_TTL)
+search_cache.register_metrics("search")
+# Concurrent searches for the same (normalized) query share one request.
+search_flight = SingleFlight()
 
 
 def format_search_results(brave_results: Dict, results_limit: int = 10):
@@ -21,13 +48,99 @@ def format_search_results(brave_results: Dict, results_limit: int = 10):
     return output_data[:results_limit]
 
 
-def search_brave(query: str):
-    url = f"https://api.search.brave.com/res/v1/web/search?q={query}"
-    headers = {
+def get_headers():
+    # The key is checked when the first client is built rather than on
+    # import, so workers that never search can start without it.
+    api_key = os.getenv("BRAVE_API_KEY")
+    if not api_key:
+        raise ProviderNotConfiguredError(
+            "BRAVE_API_KEY environment variable is required to search")
+    return {
         "Accept": "application/json",
         "Accept-Encoding": "gzip",
-        "X-Subscription-Token": BRAVE_API_KEY
+        "X-Subscription-Token": api_key
     }
 
-    response = requests.get(url, headers=headers)
+
+def check_search_configured():
+    get_headers()
+
+
+@cache
+def get_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1,
+                          pool_maxsize=BRAVE_MAX_CONNECTIONS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(get_headers())
+    return session
+
+
+@cache
+def get_async_client():
+    return httpx.AsyncClient(
+        headers=get_headers(),
+        timeout=BRAVE_TIMEOUT,
+        limits=httpx.Limits(max_connections=BRAVE_MAX_CONNECTIONS,
+                            max_keepalive_connections=BRAVE_MAX_CONNECTIONS))
+
+
+def search_cache_key(query: str):
+    return content_key("brave", normalize_query(query))
+
+
+def record_response(response):
+    counter("brave_response_bytes",
+            "Bytes of decoded Brave search responses").inc(
+                len(response.content))
+
+
+def fetch_brave(query: str):
+    response = get_session().get(BRAVE_SEARCH_URL,
+                                 params={"q": query},
+                                 timeout=BRAVE_TIMEOUT)
+    response.raise_for_status()
+    record_response(response)
+    return format_search_results(response.json())
+
+
+async def fetch_brave_async(query: str):
+    response = await get_async_client().get(BRAVE_SEARCH_URL,
+                                            params={"q": query})
+    response.raise_for_status()
+    record_response(response)
     return format_search_results(response.json())
+
+
+def load_search(key: str, query: str):
+    results = brave_policy.call(fetch_brave, query)
+    search_cache.set(key, results, label=normalize_query(query))
+    return results
+
+
+async def load_search_async(key: str, query: str):
+    results = await brave_policy.call_async(fetch_brave_async, query)
+    await search_cache.set_async(key, results, label=normalize_query(query))
+    return results
+
+
+def search_brave(query: str):
+    with span("search"):
+        key = search_cache_key(query)
+        cached_results = search_cache.get(key)
+        if cached_results is not None:
+            return cached_results
+        return search_flight.do(key, load_search, key, query)
+
+
+async def search_brave_async(query: str, use_cache: bool = True):
+    with span("search"):
+        if not use_cache:
+            return await brave_policy.call_async(fetch_brave_async, query)
+        key = search_cache_key(query)
+        cached_results = await search_cache.get_async(key)
+        if cached_results is not None:
+            return cached_results
+        return await search_flight.do_async(key, load_search_async, key,
+                                            query)
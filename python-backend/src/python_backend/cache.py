@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from typing import Any, Optional
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from sqlalchemy import delete
+from src.python_backend.metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str):
+    return " ".join(query.lower().split())
+
+
+def content_key(*parts: str):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class DatabaseCacheBackend:
+
+    def __init__(self, session_factory, model, prune_interval: float = 3600):
+        self.session_factory = session_factory
+        self.model = model
+        self.prune_interval = prune_interval
+        self.pruned_at = time.monotonic()
+
+    def get(self, key: str, ttl: float):
+        with self.session_factory() as db:
+            entry = db.get(self.model, key)
+            if entry is None or time.time() - entry.created_at > ttl:
+                return None
+            return entry.value
+
+    def set(self, key: str, value: Any, label: str = "", ttl: float = 0):
+        with self.session_factory() as db:
+            db.merge(
+                self.model(key=key,
+                           label=label,
+                           value=value,
+                           created_at=time.time()))
+            db.commit()
+        if ttl and time.monotonic() - self.pruned_at > self.prune_interval:
+            self.prune(ttl)
+
+    def prune(self, ttl: float):
+        # Expired rows are never read again, so they are deleted now and
+        # then rather than left to grow the table.
+        self.pruned_at = time.monotonic()
+        with self.session_factory() as db:
+            result = db.execute(
+                delete(self.model).where(
+                    self.model.created_at < time.time() - ttl))
+            db.commit()
+        return result.rowcount
+
+
+class TTLCache:
+
+    def __init__(self, maxsize: int, ttl: float, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.backend_hits = 0
+        self.backend_errors = 0
+
+    def get_local(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            if self.backend is None:
+                self.misses += 1
+            return None
+
+    def set_local(self, key: str, value: Any):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def record_backend_lookup(self, key: str, value: Optional[Any]):
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return
+            self.hits += 1
+            self.backend_hits += 1
+        self.set_local(key, value)
+
+    # The backend is an optional second tier: if it fails, lookups count as
+    # misses and writes only reach memory, so callers fall back to the
+    # network instead of failing.
+
+    def backend_get(self, key: str):
+        try:
+            return self.backend.get(key, self.ttl)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning("Error reading cache backend: %s", e)
+            return None
+
+    def backend_set(self, key: str, value: Any, label: str):
+        try:
+            self.backend.set(key, value, label, self.ttl)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning("Error writing cache backend: %s", e)
+
+    def prune(self):
+        if self.backend is None:
+            return 0
+        try:
+            return self.backend.prune(self.ttl)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning("Error pruning cache backend: %s", e)
+            return 0
+
+    def get(self, key: str):
+        value = self.get_local(key)
+        if value is not None or self.backend is None:
+            return value
+        value = self.backend_get(key)
+        self.record_backend_lookup(key, value)
+        return value
+
+    def set(self, key: str, value: Any, label: str = ""):
+        self.set_local(key, value)
+        if self.backend is not None:
+            self.backend_set(key, value, label)
+
+    async def get_async(self, key: str):
+        value = self.get_local(key)
+        if value is not None or self.backend is None:
+            return value
+        value = await asyncio.to_thread(self.backend_get, key)
+        self.record_backend_lookup(key, value)
+        return value
+
+    async def set_async(self, key: str, value: Any, label: str = ""):
+        self.set_local(key, value)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend_set, key, value, label)
+
+    def register_metrics(self, name: str):
+        gauge("cache_hits", "Cache lookups that found an entry",
+              lambda: self.hits, cache=name)
+        gauge("cache_misses", "Cache lookups that found nothing",
+              lambda: self.misses, cache=name)
+        gauge("cache_hit_ratio", "Share of cache lookups that hit",
+              lambda: self.stats()["hit_rate"], cache=name)
+        gauge("cache_entries", "Entries held in memory",
+              lambda: len(self.entries), cache=name)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "backend_hits": self.backend_hits,
+                "backend_errors": self.backend_errors,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "persistent": self.backend is not None,
+            }
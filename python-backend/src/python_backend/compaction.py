@@ -0,0 +1,137 @@
+from collections import Counter
+from typing import Dict, List
+import math
+import os
+import re
+from src.python_backend.metrics import counter
+
+SEARCH_COMPACTION_ENABLED = os.getenv("SEARCH_COMPACTION_ENABLED",
+                                      "true").lower() in ("1", "true", "yes")
+SEARCH_RESULTS_TOKEN_BUDGET = int(
+    os.getenv("SEARCH_RESULTS_TOKEN_BUDGET", "1500"))
+SNIPPET_DUPLICATE_THRESHOLD = float(
+    os.getenv("SNIPPET_DUPLICATE_THRESHOLD", "0.6"))
+
+WORD_PATTERN = re.compile(r"\w+")
+# Words too common in search queries to say anything about relevance.
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "does", "for", "from",
+    "has", "have", "how", "in", "is", "it", "many", "much", "of", "on", "or",
+    "the", "to", "was", "what", "when", "where", "which", "who", "with"
+}
+
+
+def estimate_tokens(text: str):
+    # Roughly four characters per token for English text.
+    return len(text) // 4
+
+
+def tokenize(text: str):
+    return WORD_PATTERN.findall(text.lower())
+
+
+def shingles(words: List[str], size: int = 3):
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: set, b: set):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def split_snippets(search_results: List[Dict]):
+    snippets = []
+    for rank, result in enumerate(search_results):
+        texts = [result.get("description", ""), result.get("snippet", "")]
+        texts.extend(result.get("extra_snippets") or [])
+        for text in texts:
+            text = re.sub(r"<[^>]+>", "", text or "").strip()
+            if text:
+                snippets.append((rank, text))
+    return snippets
+
+
+def score_snippets(query: str, snippets: List[str]):
+    # BM25 over the snippets themselves, so terms every snippet shares
+    # (usually the index value) count for little.
+    documents = [tokenize(snippet) for snippet in snippets]
+    if not documents:
+        return []
+    average_length = sum(len(words) for words in documents) / len(documents)
+    document_frequency = Counter(
+        word for words in documents for word in set(words))
+    query_words = set(tokenize(query)) - STOPWORDS
+    scores = []
+    for words in documents:
+        frequency = Counter(words)
+        score = 0.0
+        for word in query_words:
+            if word not in frequency:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency[word] +
+                                0.5) / (document_frequency[word] + 0.5))
+            tf = frequency[word]
+            score += idf * tf * 2.2 / (tf + 1.2 *
+                                      (0.25 + 0.75 * len(words) /
+                                       max(average_length, 1)))
+        scores.append(score)
+    return scores
+
+
+def compact_search_results(query: str,
+                           search_results: List[Dict],
+                           token_budget: int = SEARCH_RESULTS_TOKEN_BUDGET):
+    """Drops near-duplicate snippets and keeps the ones most relevant to
+    the query until the token budget is spent. Results keep their title and
+    url so the consolidation prompt can still cite them."""
+    snippets = split_snippets(search_results)
+    scores = score_snippets(query, [text for _, text in snippets])
+    # Ties keep the search engine's order.
+    order = sorted(range(len(snippets)),
+                   key=lambda i: (-scores[i], snippets[i][0], i))
+    kept = []
+    kept_shingles = []
+    used_tokens = sum(
+        estimate_tokens(result.get("title", "") + result.get("url", ""))
+        for result in search_results)
+    for i in order:
+        rank, text = snippets[i]
+        snippet_shingles = shingles(tokenize(text))
+        if any(
+                jaccard(snippet_shingles, other) >= SNIPPET_DUPLICATE_THRESHOLD
+                for other in kept_shingles):
+            continue
+        tokens = estimate_tokens(text)
+        if used_tokens + tokens > token_budget and kept:
+            continue
+        kept.append(i)
+        kept_shingles.append(snippet_shingles)
+        used_tokens += tokens
+
+    snippets_by_rank = {}
+    for i in sorted(kept):
+        rank, text = snippets[i]
+        snippets_by_rank.setdefault(rank, []).append(text)
+    return [{
+        "title": result.get("title", ""),
+        "url": result.get("url", ""),
+        "snippets": snippets_by_rank.get(rank, []),
+    } for rank, result in enumerate(search_results)]
+
+
+def compact_for_prompt(query: str, search_results):
+    # Search results are usually Brave's list of dicts; anything else (or
+    # compaction being off) is passed through untouched.
+    if not SEARCH_COMPACTION_ENABLED or not isinstance(search_results, list):
+        return search_results
+    compacted = compact_search_results(query, search_results)
+    counter("search_results_tokens",
+            "Estimated tokens of search results put into prompts",
+            stage="before").inc(estimate_tokens(str(search_results)))
+    counter("search_results_tokens",
+            "Estimated tokens of search results put into prompts",
+            stage="after").inc(estimate_tokens(str(compacted)))
+    return compacted
@@ -0,0 +1,403 @@
+from itertools import batched
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+import src.python_backend.models as models
+
+
+class SheetNotFoundError(Exception):
+    pass
+
+
+class VersionConflictError(Exception):
+
+    def __init__(self, current_version: int):
+        super().__init__(f"Sheet is at version {current_version}")
+        self.current_version = current_version
+
+
+def decode_json(value):
+    # Older saves stored json.dumps strings inside the JSON columns.
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+NO_PROVENANCE = {"query": None, "input_hash": None, "fetched_at": None}
+
+
+def cell_text(value):
+    return "" if value is None else str(value)
+
+
+def read_sheet_contents(db: Session, sheet_id: str):
+    columns = list(
+        db.scalars(
+            select(models.SheetColumn.name).where(
+                models.SheetColumn.sheet_id == sheet_id).order_by(
+                    models.SheetColumn.position)))
+    data, sources = read_row_range(db, sheet_id, 0, get_row_count(db, sheet_id),
+                                   len(columns))
+    return columns, data, sources
+
+
+def read_sheet_header(db: Session, sheet_id: str):
+    sheet = db.get(models.Sheet, sheet_id)
+    if sheet is None:
+        return None
+    columns = list(
+        db.scalars(
+            select(models.SheetColumn.name).where(
+                models.SheetColumn.sheet_id == sheet_id).order_by(
+                    models.SheetColumn.position)))
+    return {
+        "id": sheet.id,
+        "title": sheet.title,
+        "description": sheet.description,
+        "indexColumn": sheet.index_column,
+        "columns": columns,
+        "rowCount": get_row_count(db, sheet_id),
+        "version": sheet.version,
+    }
+
+
+def read_row_range(db: Session, sheet_id: str, row_start: int, row_end: int,
+                   column_count: int):
+    # Dense values and sources of rows [row_start, row_end).
+    data = [[""] * column_count for _ in range(row_end - row_start)]
+    sources = [[""] * column_count for _ in range(row_end - row_start)]
+    cells = db.execute(
+        select(models.Cell.row_index, models.Cell.col_index,
+               models.Cell.value, models.Cell.source).where(
+                   models.Cell.sheet_id == sheet_id,
+                   models.Cell.row_index >= row_start,
+                   models.Cell.row_index < row_end,
+                   models.Cell.col_index < column_count))
+    for row, col, value, source in cells:
+        data[row - row_start][col] = value
+        sources[row - row_start][col] = source
+    return data, sources
+
+
+def read_cell_range(db: Session, sheet_id: str, row_start: int, row_end: int,
+                    col_start: int, col_end: int):
+    return db.execute(
+        select(models.Cell.row_index, models.Cell.col_index,
+               models.Cell.value, models.Cell.source, models.Cell.query,
+               models.Cell.fetched_at).where(
+                   models.Cell.sheet_id == sheet_id,
+                   models.Cell.row_index >= row_start,
+                   models.Cell.row_index < row_end,
+                   models.Cell.col_index >= col_start,
+                   models.Cell.col_index < col_end).order_by(
+                       models.Cell.row_index, models.Cell.col_index)).all()
+
+
+def read_provenance(db: Session, sheet_id: str):
+    return {(row, col): (query, input_hash, fetched_at)
+            for row, col, query, input_hash, fetched_at in db.execute(
+                select(models.Cell.row_index, models.Cell.col_index,
+                       models.Cell.query, models.Cell.input_hash,
+                       models.Cell.fetched_at).where(
+                           models.Cell.sheet_id == sheet_id,
+                           models.Cell.input_hash.isnot(None)))}
+
+
+def replace_sheet_contents(db: Session, sheet_id: str, columns: List[str],
+                           data: List[List], sources: Optional[List[List]]):
+    sources = sources or []
+    # Whole-sheet saves carry no provenance, so keep it for cells whose
+    # value and source are unchanged even if they moved. A wrong match only
+    # costs a recompute: the input hash covers the row and column.
+    provenance = {}
+    for value, source, query, input_hash, fetched_at in db.execute(
+            select(models.Cell.value, models.Cell.source, models.Cell.query,
+                   models.Cell.input_hash, models.Cell.fetched_at).where(
+                       models.Cell.sheet_id == sheet_id,
+                       models.Cell.input_hash.isnot(None))):
+        provenance[(value, source)] = {
+            "query": query,
+            "input_hash": input_hash,
+            "fetched_at": fetched_at
+        }
+    replace_columns(db, sheet_id, columns)
+    insert_rows(db, sheet_id, 0, len(columns), data, sources, provenance)
+
+
+def replace_columns(db: Session, sheet_id: str, columns: List[str]):
+    # Clears the sheet's rows and cells along with its columns.
+    for model in (models.Cell, models.SheetRow, models.SheetColumn):
+        db.execute(delete(model).where(model.sheet_id == sheet_id))
+    if columns:
+        db.execute(insert(models.SheetColumn), [{
+            "sheet_id": sheet_id,
+            "position": position,
+            "name": cell_text(name)
+        } for position, name in enumerate(columns)])
+
+
+def insert_rows(db: Session,
+                sheet_id: str,
+                first_row: int,
+                column_count: int,
+                data: List[List],
+                sources: List[List],
+                provenance: Optional[Dict] = None):
+    # Bulk-inserts rows starting at first_row, which must be past the
+    # sheet's last row. Only non-empty cells are stored.
+    provenance = provenance or {}
+    row_count = max(len(data), len(sources))
+    if row_count:
+        db.execute(insert(models.SheetRow), [{
+            "sheet_id": sheet_id,
+            "position": first_row + offset
+        } for offset in range(row_count)])
+    cells = []
+    for offset in range(row_count):
+        values = data[offset] if offset < len(data) else []
+        row_sources = sources[offset] if offset < len(sources) else []
+        for col in range(column_count):
+            value = cell_text(values[col]) if col < len(values) else ""
+            source = cell_text(
+                row_sources[col]) if col < len(row_sources) else ""
+            if value or source:
+                cells.append({
+                    "sheet_id": sheet_id,
+                    "row_index": first_row + offset,
+                    "col_index": col,
+                    "value": value,
+                    "source": source,
+                    **provenance.get((value, source), NO_PROVENANCE)
+                })
+    if cells:
+        db.execute(insert(models.Cell), cells)
+
+
+def save_sheet_metadata(db: Session, sheet_id: str, metadata: Dict):
+    existing_sheet = db.get(models.Sheet, sheet_id)
+    if existing_sheet:
+        for key, value in metadata.items():
+            setattr(existing_sheet, key, value)
+        existing_sheet.version += 1
+    else:
+        existing_sheet = models.Sheet(id=sheet_id, version=0, **metadata)
+        db.add(existing_sheet)
+    db.flush()
+    return existing_sheet
+
+
+def upsert_sheet(db: Session, sheet: Dict):
+    sheet_id = sheet["id"]
+    save_sheet_metadata(
+        db, sheet_id, {
+            "title": sheet.get("title", ""),
+            "description": sheet.get("description", ""),
+            "index_column": sheet.get("indexColumn", ""),
+        })
+    replace_sheet_contents(db, sheet_id, sheet.get("columns", []),
+                           sheet.get("data", []), sheet.get("sources", []))
+    db.commit()
+
+
+def import_sheet(db: Session, sheet_id: str, metadata: Dict,
+                 columns: List[str], rows: Iterable[Tuple[List, List]],
+                 chunk_rows: int):
+    # Replaces the sheet with (values, sources) rows read from an iterator,
+    # inserting chunk_rows at a time so the sheet never has to fit in
+    # memory. Everything is one transaction: a failed import changes
+    # nothing. Metadata left as None keeps the existing sheet's value.
+    existing_sheet = db.get(models.Sheet, sheet_id)
+    metadata = {
+        key: value if value is not None else
+        getattr(existing_sheet, key, None) or ""
+        for key, value in metadata.items()
+    }
+    sheet = save_sheet_metadata(db, sheet_id, metadata)
+    replace_columns(db, sheet_id, columns)
+    row_count = 0
+    for chunk in batched(rows, chunk_rows):
+        insert_rows(db, sheet_id, row_count, len(columns),
+                    [values for values, _ in chunk],
+                    [sources for _, sources in chunk])
+        row_count += len(chunk)
+    version = sheet.version
+    db.commit()
+    return row_count, version
+
+
+def get_row_count(db: Session, sheet_id: str):
+    last_row = db.scalar(
+        select(func.max(models.SheetRow.position)).where(
+            models.SheetRow.sheet_id == sheet_id))
+    return 0 if last_row is None else last_row + 1
+
+
+def get_column_count(db: Session, sheet_id: str):
+    return db.scalar(
+        select(func.count()).select_from(models.SheetColumn).where(
+            models.SheetColumn.sheet_id == sheet_id))
+
+
+def has_position(db: Session, model, sheet_id: str, position: int):
+    return db.scalar(
+        select(model.position).where(model.sheet_id == sheet_id,
+                                     model.position == position)) is not None
+
+
+def shift_positions(db: Session, model, attr: str, sheet_id: str, start: int,
+                    delta: int):
+    # Positions are part of each table's primary key, so shifting them in
+    # one UPDATE can collide mid-statement. Move the affected rows into the
+    # negative range first, then back to their final positions.
+    column = getattr(model, attr)
+    db.execute(
+        update(model).where(model.sheet_id == sheet_id,
+                            column >= start).values(
+                                {attr: -(column + delta) - 1}))
+    db.execute(
+        update(model).where(model.sheet_id == sheet_id,
+                            column < 0).values({attr: -column - 1}))
+
+
+def set_cell(db: Session,
+             sheet_id: str,
+             row: int,
+             col: int,
+             value: Optional[str],
+             source: Optional[str],
+             provenance: Optional[Dict] = None):
+    # A value written without provenance is a manual edit, which clears
+    # the provenance of the autofilled value it replaces. Writing to the
+    # row just past the last one appends it; rows further out are rejected.
+    if row < 0 or not has_position(db, models.SheetColumn, sheet_id, col):
+        raise ValueError(f"Cell ({row}, {col}) is out of range")
+    if not has_position(db, models.SheetRow, sheet_id, row):
+        if row != get_row_count(db, sheet_id):
+            raise ValueError(f"Cell ({row}, {col}) is out of range")
+        db.execute(insert(models.SheetRow).values(sheet_id=sheet_id,
+                                                  position=row))
+    changes = {}
+    if value is not None:
+        changes["value"] = value
+        changes.update(provenance or NO_PROVENANCE)
+    if source is not None:
+        changes["source"] = source
+    if not changes:
+        return
+    result = db.execute(
+        update(models.Cell).where(models.Cell.sheet_id == sheet_id,
+                                  models.Cell.row_index == row,
+                                  models.Cell.col_index == col).values(changes))
+    if result.rowcount == 0:
+        db.execute(
+            insert(models.Cell).values(sheet_id=sheet_id,
+                                       row_index=row,
+                                       col_index=col,
+                                       value=value or "",
+                                       source=source or "",
+                                       **(provenance or NO_PROVENANCE)))
+
+
+def insert_row(db: Session, sheet_id: str, row: int, values: List[str],
+               sources: List[str]):
+    if not 0 <= row <= get_row_count(db, sheet_id):
+        raise ValueError(f"Row {row} is out of range")
+    shift_positions(db, models.SheetRow, "position", sheet_id, row, 1)
+    shift_positions(db, models.Cell, "row_index", sheet_id, row, 1)
+    db.execute(insert(models.SheetRow).values(sheet_id=sheet_id,
+                                              position=row))
+    column_count = get_column_count(db, sheet_id)
+    for col in range(min(max(len(values), len(sources)), column_count)):
+        value = values[col] if col < len(values) else ""
+        source = sources[col] if col < len(sources) else ""
+        if value or source:
+            set_cell(db, sheet_id, row, col, value, source)
+
+
+def delete_row(db: Session, sheet_id: str, row: int):
+    if not has_position(db, models.SheetRow, sheet_id, row):
+        raise ValueError(f"Row {row} is out of range")
+    db.execute(
+        delete(models.SheetRow).where(models.SheetRow.sheet_id == sheet_id,
+                                      models.SheetRow.position == row))
+    db.execute(
+        delete(models.Cell).where(models.Cell.sheet_id == sheet_id,
+                                  models.Cell.row_index == row))
+    shift_positions(db, models.SheetRow, "position", sheet_id, row + 1, -1)
+    shift_positions(db, models.Cell, "row_index", sheet_id, row + 1, -1)
+
+
+def insert_column(db: Session, sheet_id: str, col: int, name: str):
+    if not 0 <= col <= get_column_count(db, sheet_id):
+        raise ValueError(f"Column {col} is out of range")
+    shift_positions(db, models.SheetColumn, "position", sheet_id, col, 1)
+    shift_positions(db, models.Cell, "col_index", sheet_id, col, 1)
+    db.execute(
+        insert(models.SheetColumn).values(sheet_id=sheet_id,
+                                          position=col,
+                                          name=name))
+
+
+def delete_column(db: Session, sheet_id: str, col: int):
+    if not has_position(db, models.SheetColumn, sheet_id, col):
+        raise ValueError(f"Column {col} is out of range")
+    db.execute(
+        delete(models.SheetColumn).where(
+            models.SheetColumn.sheet_id == sheet_id,
+            models.SheetColumn.position == col))
+    db.execute(
+        delete(models.Cell).where(models.Cell.sheet_id == sheet_id,
+                                  models.Cell.col_index == col))
+    shift_positions(db, models.SheetColumn, "position", sheet_id, col + 1, -1)
+    shift_positions(db, models.Cell, "col_index", sheet_id, col + 1, -1)
+
+
+def rename_column(db: Session, sheet_id: str, col: int, name: str):
+    result = db.execute(
+        update(models.SheetColumn).where(
+            models.SheetColumn.sheet_id == sheet_id,
+            models.SheetColumn.position == col).values(name=name))
+    if result.rowcount == 0:
+        raise ValueError(f"Column {col} is out of range")
+
+
+def apply_op(db: Session, sheet_id: str, op):
+    if op.op == "set_cell":
+        set_cell(db, sheet_id, op.row, op.col, op.value, op.source)
+    elif op.op == "insert_row":
+        insert_row(db, sheet_id, op.row, op.values or [], op.sources or [])
+    elif op.op == "delete_row":
+        delete_row(db, sheet_id, op.row)
+    elif op.op == "insert_column":
+        insert_column(db, sheet_id, op.col, op.name)
+    elif op.op == "delete_column":
+        delete_column(db, sheet_id, op.col)
+    elif op.op == "rename_column":
+        rename_column(db, sheet_id, op.col, op.name)
+    else:
+        raise ValueError(f"Unknown operation {op.op}")
+
+
+def patch_sheet(db: Session, sheet_id: str, version: int, ops: List):
+    # Bumping the version first both checks it and, on databases with row
+    # locks, holds the sheet row until commit so patches apply one at a time.
+    result = db.execute(
+        update(models.Sheet).where(models.Sheet.id == sheet_id,
+                                   models.Sheet.version == version).values(
+                                       version=version + 1))
+    if result.rowcount != 1:
+        current_version = db.scalar(
+            select(models.Sheet.version).where(models.Sheet.id == sheet_id))
+        db.rollback()
+        if current_version is None:
+            raise SheetNotFoundError(sheet_id)
+        raise VersionConflictError(current_version)
+    try:
+        for op in ops:
+            apply_op(db, sheet_id, op)
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+    return version + 1
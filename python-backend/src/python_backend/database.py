@@ -1,15 +1,159 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from fastapi.concurrency import run_in_threadpool
+from functools import cache
 import os
+import time
 from dotenv import load_dotenv
+from src.python_backend.metrics import counter, gauge, histogram
+from src.python_backend.serialization import dumps_text, loads
 
 load_dotenv()
 
 URL_DATABASE = os.getenv("URL_DATABASE", None)
-if URL_DATABASE is None:
-    raise ValueError("URL_DATABASE environment variable is required")
 
-engine = create_engine(URL_DATABASE)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+# Optional async driver URL (e.g. postgresql+asyncpg://...) used by the sheet
+# endpoints instead of running the sync engine in a thread pool.
+ASYNC_URL_DATABASE = os.getenv("ASYNC_URL_DATABASE", None)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING",
+                             "true").lower() in ("1", "true", "yes")
+
+
+def pool_checkout_seconds(engine_name: str):
+    return histogram("db_pool_checkout_seconds",
+                     "Time spent waiting to check out a pooled connection",
+                     engine=engine_name)
+
+
+def pool_timeouts(engine_name: str):
+    return counter("db_pool_timeouts",
+                   "Checkouts that gave up after DB_POOL_TIMEOUT",
+                   engine=engine_name)
+
+
+class TimedPoolMixin:
+    # Records how long each checkout waited for a connection, which is the
+    # first thing to grow when the pool is too small for the traffic.
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_timeouts(self.engine_name).inc()
+            raise
+        finally:
+            pool_checkout_seconds(self.engine_name).observe(
+                time.perf_counter() - start)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    engine_name = "sync"
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    engine_name = "async"
+
+
+def is_memory_sqlite(url: str):
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (
+        None, "", ":memory:")
+
+
+def get_engine_args(url: str, poolclass):
+    args = {"json_serializer": dumps_text, "json_deserializer": loads}
+    if is_memory_sqlite(url):
+        # In-memory SQLite lives in a single connection, so it keeps the
+        # dialect's default pool.
+        return args
+    return {
+        **args,
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def register_pool_metrics(pool, name: str):
+    if not isinstance(pool, QueuePool):
+        return
+    capacity = pool.size() + max(DB_MAX_OVERFLOW, 0)
+    pool_checkout_seconds(name)
+    pool_timeouts(name)
+    gauge("db_pool_size", "Configured pool size", pool.size, engine=name)
+    gauge("db_pool_checked_out",
+          "Connections currently checked out",
+          pool.checkedout,
+          engine=name)
+    gauge("db_pool_saturation",
+          "Checked out connections over pool size plus overflow",
+          lambda: pool.checkedout() / capacity if capacity else 0.0,
+          engine=name)
+
+
+Base = declarative_base()
+
+
+# Engines are created on first use rather than on import, so modules that
+# only need the models (and workers that have not touched the database yet)
+# do not require URL_DATABASE.
+@cache
+def get_engine():
+    if URL_DATABASE is None:
+        raise ValueError("URL_DATABASE environment variable is required")
+    engine = create_engine(URL_DATABASE,
+                           **get_engine_args(URL_DATABASE, TimedQueuePool))
+    register_pool_metrics(engine.pool, "sync")
+    return engine
+
+
+@cache
+def get_sessionmaker():
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+
+def SessionLocal():
+    return get_sessionmaker()()
+
+
+@cache
+def get_async_sessionmaker():
+    if not ASYNC_URL_DATABASE:
+        return None
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    async_engine = create_async_engine(
+        ASYNC_URL_DATABASE,
+        **get_engine_args(ASYNC_URL_DATABASE, TimedAsyncAdaptedQueuePool))
+    register_pool_metrics(async_engine.pool, "async")
+    return async_sessionmaker(async_engine,
+                              autoflush=False,
+                              expire_on_commit=False)
+
+
+def with_session(fn, *args, **kwargs):
+    with SessionLocal() as db:
+        return fn(db, *args, **kwargs)
+
+
+async def run_db(fn, *args, **kwargs):
+    # Runs fn(db, *args) in its own short-lived session, so a connection is
+    # only held for the database work and not for the rest of the request.
+    # With the async engine the sync crud code runs through run_sync;
+    # otherwise it runs in a worker thread to keep the event loop free.
+    async_session = get_async_sessionmaker()
+    if async_session is not None:
+        async with async_session() as db:
+            return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(with_session, fn, *args, **kwargs)
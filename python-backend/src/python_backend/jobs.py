@@ -0,0 +1,631 @@
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+import time
+import uuid
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+import src.python_backend.models as models
+from src.python_backend.ai_functions import get_queries_to_search_async, research_cell_async
+from src.python_backend.cache import content_key
+from src.python_backend.crud import SheetNotFoundError, read_provenance, read_sheet_contents, set_cell
+from src.python_backend.database import run_db
+from src.python_backend.scheduler import autofill_scheduler
+
+logger = logging.getLogger(__name__)
+
+AUTOFILL_JOB_WORKERS = int(os.getenv("AUTOFILL_JOB_WORKERS", "4"))
+AUTOFILL_JOB_POLL_INTERVAL = float(
+    os.getenv("AUTOFILL_JOB_POLL_INTERVAL", "2"))
+# Seconds a worker's claim on a row lasts without being renewed. Rows of a
+# process that stopped are queued again once their claim expires.
+AUTOFILL_JOB_LEASE_SECONDS = float(
+    os.getenv("AUTOFILL_JOB_LEASE_SECONDS", "300"))
+# How long an autofilled value stays fresh for "stale" re-fills.
+AUTOFILL_FRESHNESS_SECONDS = float(
+    os.getenv("AUTOFILL_FRESHNESS_SECONDS", str(7 * 24 * 3600)))
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+ALL = "all"
+STALE = "stale"
+UNKNOWN = "unknown"
+
+ACTIVE_STATUSES = (PENDING, RUNNING)
+FINISHED_TASK_STATUSES = (DONE, FAILED, SKIPPED, CANCELLED)
+
+# Job and task state lives in the database so a restart picks up where the
+# last process stopped. Each function below runs inside run_db.
+
+
+def cell_input_hash(description: str, index_value: str, col_name: str):
+    return content_key(description, index_value, col_name)
+
+
+def needs_refill(value: str, provenance, input_hash: str, cutoff: float):
+    # Returns (refill, query to reuse). Empty and "unknown" cells (the
+    # placeholder for failed or unanswered research) are filled. Other
+    # values without provenance were typed by hand and are left alone.
+    # Autofilled values are redone when their inputs changed, or
+    # re-researched with the same query once they are older than the cutoff.
+    if not value or value == UNKNOWN:
+        return True, None
+    if provenance is None:
+        return False, None
+    query, previous_hash, fetched_at = provenance
+    if previous_hash != input_hash:
+        return True, None
+    if (fetched_at or 0) < cutoff:
+        return True, query
+    return False, None
+
+
+def create_job(db: Session,
+               sheet_id: str,
+               description: Optional[str],
+               columns: Optional[List[int]],
+               rows: Optional[List[int]],
+               mode: str = ALL,
+               max_age: Optional[float] = None):
+    sheet = db.get(models.Sheet, sheet_id)
+    if sheet is None:
+        raise SheetNotFoundError(sheet_id)
+    sheet_columns, data, _ = read_sheet_contents(db, sheet_id)
+    if sheet.index_column in sheet_columns:
+        index_col = sheet_columns.index(sheet.index_column)
+    else:
+        index_col = 0
+    if columns is None:
+        columns = [
+            col for col in range(len(sheet_columns)) if col != index_col
+        ]
+    if rows is None:
+        rows = list(range(len(data)))
+    for col in columns:
+        if not 0 <= col < len(sheet_columns) or col == index_col:
+            raise ValueError(f"Column {col} cannot be autofilled")
+    for row in rows:
+        if not 0 <= row < len(data):
+            raise ValueError(f"Row {row} is out of range")
+    if mode not in (ALL, STALE):
+        raise ValueError(f"Unknown autofill mode {mode}")
+    if description is None:
+        description = sheet.description or ""
+
+    now = time.time()
+    provenance = read_provenance(db, sheet_id) if mode == STALE else {}
+    cutoff = now - (AUTOFILL_FRESHNESS_SECONDS if max_age is None else max_age)
+    job_id = str(uuid.uuid4())
+    tasks = []
+    for row in sorted(set(rows)):
+        index_value = data[row][index_col]
+        if not index_value:
+            continue
+        for col in sorted(set(columns)):
+            query = None
+            if mode == STALE:
+                refill, query = needs_refill(
+                    data[row][col], provenance.get((row, col)),
+                    cell_input_hash(description, index_value,
+                                    sheet_columns[col]), cutoff)
+                if not refill:
+                    continue
+            tasks.append({
+                "job_id": job_id,
+                "row_index": row,
+                "col_index": col,
+                "index_value": index_value,
+                "col_name": sheet_columns[col],
+                "query": query,
+                "status": PENDING,
+                "updated_at": now,
+            })
+    db.add(
+        models.AutofillJob(
+            id=job_id,
+            sheet_id=sheet_id,
+            description=description,
+            index_col=index_col,
+            mode=mode,
+            status=PENDING if tasks else COMPLETED,
+            created_at=now,
+            updated_at=now))
+    db.flush()
+    if tasks:
+        db.execute(insert(models.AutofillTask), tasks)
+    db.commit()
+    return job_id
+
+
+def get_job_progress(db: Session, job_id: str):
+    job = db.get(models.AutofillJob, job_id)
+    if job is None:
+        return None
+    counts = dict(
+        db.execute(
+            select(models.AutofillTask.status, func.count()).where(
+                models.AutofillTask.job_id == job_id).group_by(
+                    models.AutofillTask.status)).all())
+    return {
+        "id": job.id,
+        "sheet_id": job.sheet_id,
+        "status": job.status,
+        "total": sum(counts.values()),
+        "counts": counts,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+def read_finished_tasks(db: Session, job_id: str):
+    return db.execute(
+        select(models.AutofillTask.row_index, models.AutofillTask.col_index,
+               models.AutofillTask.status, models.AutofillTask.value,
+               models.AutofillTask.source, models.AutofillTask.error).where(
+                   models.AutofillTask.job_id == job_id,
+                   models.AutofillTask.status.in_(
+                       FINISHED_TASK_STATUSES)).order_by(
+                           models.AutofillTask.updated_at)).all()
+
+
+def reset_expired_tasks(db: Session, lease: float):
+    # Tasks claimed by a process that stopped renewing them go back in the
+    # queue. Claims of live workers, finished tasks and generated queries
+    # are kept.
+    now = time.time()
+    result = db.execute(
+        update(models.AutofillTask).where(
+            models.AutofillTask.status == RUNNING,
+            models.AutofillTask.updated_at < now - lease).values(
+                status=PENDING, owner=None, updated_at=now))
+    db.commit()
+    return result.rowcount
+
+
+def release_claims(db: Session, owner: str):
+    # Puts a stopping process's running tasks straight back in the queue
+    # rather than leaving them until their lease expires.
+    result = db.execute(
+        update(models.AutofillTask).where(
+            models.AutofillTask.status == RUNNING,
+            models.AutofillTask.owner == owner).values(status=PENDING,
+                                                       owner=None,
+                                                       updated_at=time.time()))
+    db.commit()
+    return result.rowcount
+
+
+def owned_tasks(job_id: str, row: int, owner: str):
+    return (models.AutofillTask.job_id == job_id,
+            models.AutofillTask.row_index == row,
+            models.AutofillTask.status == RUNNING,
+            models.AutofillTask.owner == owner)
+
+
+def renew_claim(db: Session, job_id: str, row: int, owner: str):
+    db.execute(
+        update(models.AutofillTask).where(*owned_tasks(
+            job_id, row, owner)).values(updated_at=time.time()))
+    db.commit()
+
+
+def claim_row(db: Session, owner: str):
+    # Claims every pending task of the oldest job's next row for owner. The
+    # claim is a conditional UPDATE, so two workers racing for a row cannot
+    # both win.
+    for _ in range(3):
+        next_row = db.execute(
+            select(models.AutofillTask.job_id,
+                   models.AutofillTask.row_index).join(
+                       models.AutofillJob).where(
+                           models.AutofillTask.status == PENDING,
+                           models.AutofillJob.status.in_(
+                               ACTIVE_STATUSES)).order_by(
+                                   models.AutofillJob.created_at,
+                                   models.AutofillTask.row_index).limit(
+                                       1)).first()
+        if next_row is None:
+            return None
+        job_id, row = next_row
+        now = time.time()
+        claimed = db.execute(
+            update(models.AutofillTask).where(
+                models.AutofillTask.job_id == job_id,
+                models.AutofillTask.row_index == row,
+                models.AutofillTask.status == PENDING).values(
+                    status=RUNNING, owner=owner, updated_at=now)).rowcount
+        db.execute(
+            update(models.AutofillJob).where(
+                models.AutofillJob.id == job_id,
+                models.AutofillJob.status == PENDING).values(status=RUNNING,
+                                                             updated_at=now))
+        db.commit()
+        if claimed:
+            break
+    else:
+        return None
+    job = db.get(models.AutofillJob, job_id)
+    tasks = db.execute(
+        select(models.AutofillTask.col_index, models.AutofillTask.col_name,
+               models.AutofillTask.index_value,
+               models.AutofillTask.query).where(
+                   *owned_tasks(job_id, row, owner))).all()
+    return {
+        "owner": owner,
+        "job_id": job_id,
+        "sheet_id": job.sheet_id,
+        "description": job.description,
+        "index_col": job.index_col,
+        "mode": job.mode,
+        "row": row,
+        "tasks": tasks,
+    }
+
+
+def save_queries(db: Session, job_id: str, row: int, queries: Dict[int, str]):
+    for col, query in queries.items():
+        db.execute(
+            update(models.AutofillTask).where(
+                models.AutofillTask.job_id == job_id,
+                models.AutofillTask.row_index == row,
+                models.AutofillTask.col_index == col).values(query=query))
+    db.commit()
+
+
+def finish_task(db: Session, claim: Dict, col: int, status: str,
+                error: Optional[str] = None):
+    db.execute(
+        update(models.AutofillTask).where(
+            *owned_tasks(claim["job_id"], claim["row"], claim["owner"]),
+            models.AutofillTask.col_index == col).values(
+                status=status, error=error, updated_at=time.time()))
+    db.commit()
+
+
+def fail_running_tasks(db: Session, claim: Dict, error: str):
+    db.execute(
+        update(models.AutofillTask).where(
+            *owned_tasks(claim["job_id"], claim["row"],
+                         claim["owner"])).values(status=FAILED,
+                                                 error=error,
+                                                 updated_at=time.time()))
+    db.commit()
+
+
+def store_result(db: Session, claim: Dict, col: int, col_name: str,
+                 index_value: str, query: str, value: str, source: str):
+    # Rows and columns are addressed by position, so an edit made while the
+    # job ran can move them. The result is only written if the cell's row
+    # and column still hold the index value and name the task was made for,
+    # and only while this worker still holds the claim. Returns None as the
+    # status if the claim expired and the row went to another worker.
+    job_id, sheet_id, row = claim["job_id"], claim["sheet_id"], claim["row"]
+    job_status = db.scalar(
+        select(models.AutofillJob.status).where(
+            models.AutofillJob.id == job_id))
+    current_index_value = db.scalar(
+        select(models.Cell.value).where(
+            models.Cell.sheet_id == sheet_id, models.Cell.row_index == row,
+            models.Cell.col_index == claim["index_col"]))
+    current_col_name = db.scalar(
+        select(models.SheetColumn.name).where(
+            models.SheetColumn.sheet_id == sheet_id,
+            models.SheetColumn.position == col))
+    status, error = DONE, None
+    if job_status == CANCELLED:
+        status = CANCELLED
+    elif current_index_value != index_value or current_col_name != col_name:
+        status, error = SKIPPED, "Sheet changed while the job was running"
+    else:
+        set_cell(db, sheet_id, row, col, value, source, {
+            "query": query,
+            "input_hash": cell_input_hash(claim["description"], index_value,
+                                          col_name),
+            "fetched_at": time.time()
+        })
+        db.execute(
+            update(models.Sheet).where(models.Sheet.id == sheet_id).values(
+                version=models.Sheet.version + 1))
+    claimed = db.execute(
+        update(models.AutofillTask).where(
+            *owned_tasks(job_id, row, claim["owner"]),
+            models.AutofillTask.col_index == col).values(
+                status=status,
+                value=value,
+                source=source,
+                error=error,
+                updated_at=time.time())).rowcount
+    if not claimed:
+        db.rollback()
+        return None, None
+    db.commit()
+    return status, error
+
+
+def finish_job_if_done(db: Session, job_id: str):
+    remaining = db.scalar(
+        select(func.count()).select_from(models.AutofillTask).where(
+            models.AutofillTask.job_id == job_id,
+            models.AutofillTask.status.in_(ACTIVE_STATUSES)))
+    if remaining:
+        return False
+    result = db.execute(
+        update(models.AutofillJob).where(
+            models.AutofillJob.id == job_id,
+            models.AutofillJob.status.in_(ACTIVE_STATUSES)).values(
+                status=COMPLETED, updated_at=time.time()))
+    db.commit()
+    return result.rowcount > 0
+
+
+def cancel_job(db: Session, job_id: str):
+    now = time.time()
+    result = db.execute(
+        update(models.AutofillJob).where(
+            models.AutofillJob.id == job_id,
+            models.AutofillJob.status.in_(ACTIVE_STATUSES)).values(
+                status=CANCELLED, updated_at=now))
+    db.execute(
+        update(models.AutofillTask).where(
+            models.AutofillTask.job_id == job_id,
+            models.AutofillTask.status == PENDING).values(status=CANCELLED,
+                                                          updated_at=now))
+    db.commit()
+    return result.rowcount > 0
+
+
+class JobRunner:
+
+    def __init__(self, workers: int, poll_interval: float, lease: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        # Identifies this process's claims, so several processes can share
+        # the queue.
+        self.owner = str(uuid.uuid4())
+        self.reaper = None
+        self.wakeup = asyncio.Event()
+        self.worker_tasks = []
+        self.listeners: Dict[str, List[asyncio.Queue]] = {}
+        self.rows_running = 0
+        self.rows_completed = 0
+
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        self.worker_tasks = [
+            asyncio.create_task(self.work()) for _ in range(self.workers)
+        ]
+        self.reaper = asyncio.create_task(self.reap())
+
+    async def stop(self):
+        tasks = self.worker_tasks + ([self.reaper] if self.reaper else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.worker_tasks = []
+        try:
+            await run_db(release_claims, self.owner)
+        except Exception as e:
+            logger.warning("Error releasing autofill claims: %s", e)
+
+    def notify(self):
+        self.wakeup.set()
+
+    def subscribe(self, job_id: str):
+        queue = asyncio.Queue()
+        self.listeners.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self.listeners.get(job_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self.listeners.pop(job_id, None)
+
+    def publish(self, job_id: str, event: Dict):
+        for queue in self.listeners.get(job_id, []):
+            queue.put_nowait(event)
+
+    async def reap(self):
+        while True:
+            try:
+                if await run_db(reset_expired_tasks, self.lease):
+                    self.notify()
+            except Exception as e:
+                logger.warning("Error requeueing expired autofill tasks: %s",
+                               e)
+            await asyncio.sleep(self.lease / 2)
+
+    async def heartbeat(self, claim: Dict):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await run_db(renew_claim, claim["job_id"], claim["row"],
+                             self.owner)
+            except Exception as e:
+                logger.warning("Error renewing claim on autofill row %d: %s",
+                               claim["row"], e)
+
+    async def work(self):
+        while True:
+            try:
+                claim = await run_db(claim_row, self.owner)
+            except Exception as e:
+                logger.warning("Error claiming autofill task: %s", e)
+                claim = None
+            if claim is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(),
+                                           self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.rows_running += 1
+            heartbeat = asyncio.create_task(self.heartbeat(claim))
+            try:
+                await self.run_row(claim)
+            except Exception as e:
+                logger.exception("Error running autofill row %d",
+                                 claim["row"])
+                await self.fail_row(claim, str(e) or repr(e))
+            finally:
+                heartbeat.cancel()
+                self.rows_running -= 1
+                self.rows_completed += 1
+
+    async def finish_task(self, claim: Dict, col: int, status: str,
+                          error: str):
+        await run_db(finish_task, claim, col, status, error)
+        self.publish(claim["job_id"], {
+            "event": "cell",
+            "row": claim["row"],
+            "col": col,
+            "status": status,
+            "error": error
+        })
+
+    async def fail_row(self, claim: Dict, error: str):
+        # Marks the row's unfinished tasks failed so the job can complete
+        # and its event stream ends.
+        job_id = claim["job_id"]
+        try:
+            await run_db(fail_running_tasks, claim, error)
+            if await run_db(finish_job_if_done, job_id):
+                self.publish(job_id, {"event": "done"})
+        except Exception as e:
+            logger.warning("Error failing autofill row %d: %s", claim["row"],
+                           e)
+
+    async def run_row(self, claim: Dict):
+        job_id, row = claim["job_id"], claim["row"]
+        tasks = claim["tasks"]
+        queries = {col: query for col, _, _, query in tasks if query}
+        missing = [(col, col_name) for col, col_name, _, query in tasks
+                   if not query]
+        if missing:
+            try:
+                query_dict = await autofill_scheduler.run(
+                    get_queries_to_search_async,
+                    [col_name for _, col_name in missing],
+                    tasks[0].index_value, claim["description"])
+            except Exception as e:
+                logger.warning("Error creating queries for %s: %s",
+                               tasks[0].index_value, e)
+                query_dict = {}
+            new_queries = {
+                col: query_dict[col_name]
+                for col, col_name in missing if col_name in query_dict
+            }
+            await run_db(save_queries, job_id, row, new_queries)
+            queries.update(new_queries)
+
+        async def fill_cell(col: int, col_name: str, index_value: str):
+            if col not in queries:
+                await self.finish_task(claim, col, FAILED,
+                                       "No search query was generated")
+                return
+            # Stale re-fills stamp the result as fetched now, so they must
+            # not be answered from the search or LLM cache.
+            try:
+                value, source = await autofill_scheduler.run(
+                    research_cell_async, claim["description"], col_name,
+                    index_value, queries[col], claim["mode"] != STALE)
+            except Exception as e:
+                # The sheet keeps its current value; a stale re-fill
+                # retries the cell.
+                logger.warning("Error processing %s for %s: %s", col_name,
+                               index_value, e)
+                await self.finish_task(claim, col, FAILED, str(e) or repr(e))
+                return
+            status, error = await run_db(store_result, claim, col, col_name,
+                                         index_value, queries[col], value,
+                                         source)
+            if status is None:
+                return
+            self.publish(
+                job_id, {
+                    "event": "cell",
+                    "row": row,
+                    "col": col,
+                    "status": status,
+                    "value": value,
+                    "source": source,
+                    "error": error
+                })
+
+        await asyncio.gather(*[
+            fill_cell(col, col_name, index_value)
+            for col, col_name, index_value, _ in tasks
+        ])
+        if await run_db(finish_job_if_done, job_id):
+            self.publish(job_id, {"event": "done"})
+
+    async def events(self, job_id: str):
+        # Replays the tasks finished so far, then follows live results until
+        # the job completes or is cancelled. Subscribing before the replay
+        # means nothing finished in between is missed; duplicates are dropped.
+        queue = self.subscribe(job_id)
+        seen = set()
+
+        async def replay():
+            for row, col, status, value, source, error in await run_db(
+                    read_finished_tasks, job_id):
+                if (row, col) not in seen:
+                    seen.add((row, col))
+                    yield {
+                        "event": "cell",
+                        "row": row,
+                        "col": col,
+                        "status": status,
+                        "value": value,
+                        "source": source,
+                        "error": error
+                    }
+
+        try:
+            async for event in replay():
+                yield event
+            progress = await run_db(get_job_progress, job_id)
+            while progress["status"] in ACTIVE_STATUSES:
+                try:
+                    event = await asyncio.wait_for(queue.get(),
+                                                   self.poll_interval)
+                except asyncio.TimeoutError:
+                    # Also notices jobs finished or cancelled elsewhere.
+                    progress = await run_db(get_job_progress, job_id)
+                    continue
+                if event["event"] == "done":
+                    break
+                if (event["row"], event["col"]) in seen:
+                    continue
+                seen.add((event["row"], event["col"]))
+                yield event
+            # Another row can finish the job before this row's last result
+            # is published, so pick up anything still missing.
+            async for event in replay():
+                yield event
+            progress = await run_db(get_job_progress, job_id)
+            yield {"event": "done", "status": progress["status"]}
+        finally:
+            self.unsubscribe(job_id, queue)
+
+    def stats(self):
+        return {
+            "workers": len(self.worker_tasks),
+            "rows_running": self.rows_running,
+            "rows_completed": self.rows_completed,
+            "listeners": sum(len(q) for q in self.listeners.values()),
+        }
+
+
+job_runner = JobRunner(AUTOFILL_JOB_WORKERS, AUTOFILL_JOB_POLL_INTERVAL,
+                       AUTOFILL_JOB_LEASE_SECONDS)
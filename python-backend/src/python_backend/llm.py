@@ -1,30 +1,118 @@
+from functools import cache, partial
 from typing import Optional
 from pydantic import BaseModel
-from groq import Groq
-from openai import OpenAI
-from anthropic import Anthropic
-import instructor
+import httpx
+import importlib
+import json
 import os
 from dotenv import load_dotenv
+from src.python_backend.cache import TTLCache, content_key
+from src.python_backend.compaction import estimate_tokens
+from src.python_backend.metrics import counter
+from src.python_backend.resilience import ProviderNotConfiguredError, policy_from_env
+from src.python_backend.router import LLM_ROUTER_CANDIDATES, LLMRouter, parse_candidates
+from src.python_backend.singleflight import SingleFlight
+from src.python_backend.tracing import span
 
 load_dotenv()
 
-GROQ_API_KEY = os.getenv("GROQ_API_KEY", None)
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", None)
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", None)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "anthropic")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
 
-if any(key is None for key in [GROQ_API_KEY, OPENAI_API_KEY, ANTHROPIC_API_KEY]):
-    raise ValueError("No API key found")
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED",
+                              "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAXSIZE = int(os.getenv("LLM_CACHE_MAXSIZE", "1024"))
+
+llm_cache = TTLCache(maxsize=LLM_CACHE_MAXSIZE, ttl=LLM_CACHE_TTL)
+llm_cache.register_metrics("llm")
+# Concurrent cacheable calls with the same prompt share one request.
+llm_flight = SingleFlight()
+
+# Rate limit, retry and circuit breaker settings per provider, overridable
+# with <PROVIDER>_RATE_LIMIT, <PROVIDER>_MAX_ATTEMPTS, etc. The SDKs raise
+# their connection errors from httpx's, so those are retried without having
+# to import the SDKs here.
+provider_policies = {
+    "groq":
+    policy_from_env("groq", rate_limit=30,
+                    retry_on=(httpx.TransportError, )),
+    "openai":
+    policy_from_env("openai", rate_limit=50,
+                    retry_on=(httpx.TransportError, )),
+    "anthropic":
+    policy_from_env("anthropic",
+                    rate_limit=50,
+                    retry_on=(httpx.TransportError, )),
+}
+
+# (module, sync client, async client, API key variable) per provider. SDKs
+# are imported on first use, so a worker only loads the ones it calls and
+# only needs keys for those.
+SDK_CLIENTS = {
+    "groq": ("groq", "Groq", "AsyncGroq", "GROQ_API_KEY"),
+    "openai": ("openai", "OpenAI", "AsyncOpenAI", "OPENAI_API_KEY"),
+    "anthropic":
+    ("anthropic", "Anthropic", "AsyncAnthropic", "ANTHROPIC_API_KEY"),
+}
+
+
+def get_api_key(provider: str):
+    key_variable = SDK_CLIENTS[provider][3]
+    api_key = os.getenv(key_variable)
+    if not api_key:
+        raise ProviderNotConfiguredError(
+            f"{key_variable} environment variable is required to use "
+            f"{provider}")
+    return api_key
+
+
+@cache
+def get_client(provider: str, is_async: bool = False):
+    module, sync_client, async_client, _ = SDK_CLIENTS[provider]
+    client_class = getattr(importlib.import_module(module),
+                           async_client if is_async else sync_client)
+    api_key = get_api_key(provider)
+    http_args = {
+        "limits":
+        httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                     max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS),
+        "timeout":
+        httpx.Timeout(LLM_TIMEOUT),
+    }
+    # Retries are handled by provider_policies, not by the SDK.
+    if is_async:
+        return client_class(api_key=api_key,
+                            timeout=LLM_TIMEOUT,
+                            max_retries=0,
+                            http_client=httpx.AsyncClient(**http_args))
+    return client_class(api_key=api_key,
+                        timeout=LLM_TIMEOUT,
+                        max_retries=0,
+                        http_client=httpx.Client(**http_args))
+
+
+@cache
+def get_instructor_client(provider: str, is_async: bool = False):
+    import instructor
+    client = get_client(provider, is_async)
+    if provider == "groq":
+        return instructor.from_groq(client, mode=instructor.Mode.JSON)
+    if provider == "anthropic":
+        return instructor.from_anthropic(client)
+    raise ValueError(f"No instructor client for provider {provider}")
 
 
 def ask_groq(prompt: str,
              model: str = "llama-3.3-70b-specdec",
              response_format: Optional[BaseModel] = None):
     additional_args = {}
-    client = Groq(api_key=GROQ_API_KEY)
+    client = get_client("groq")
     if response_format:
-        client = instructor.from_groq(Groq(api_key=GROQ_API_KEY),
-                                      mode=instructor.Mode.JSON)
+        client = get_instructor_client("groq")
         additional_args["response_model"] = response_format
     output = client.chat.completions.create(model=model,
                                             messages=[{
@@ -42,7 +130,7 @@ def ask_openai(prompt: str,
                model: str = "gpt-4o-mini-2024-07-18",
                response_format: Optional[BaseModel] = None):
     additional_args = {}
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = get_client("openai")
 
     fn = client.chat.completions.create
     if response_format:
@@ -64,10 +152,10 @@ def ask_anthropic(prompt: str,
                model: str = "claude-3-5-haiku-latest",
                response_format: Optional[BaseModel] = None):
     additional_args = {}
-    client = Anthropic(api_key=ANTHROPIC_API_KEY)
+    client = get_client("anthropic")
     if response_format:
         additional_args["response_model"] = response_format
-        client = instructor.from_anthropic(Anthropic(api_key=ANTHROPIC_API_KEY))
+        client = get_instructor_client("anthropic")
     output = client.messages.create(model=model,
                                     max_tokens=1024,
                                     messages=[{
@@ -79,4 +167,236 @@ def ask_anthropic(prompt: str,
         return output
     return output.content[0].text
 
-ASK_LLM = ask_anthropic
+
+async def ask_groq_async(prompt: str,
+                         model: str = "llama-3.3-70b-specdec",
+                         response_format: Optional[BaseModel] = None):
+    additional_args = {}
+    client = get_client("groq", is_async=True)
+    if response_format:
+        client = get_instructor_client("groq", is_async=True)
+        additional_args["response_model"] = response_format
+    output = await client.chat.completions.create(model=model,
+                                                  messages=[{
+                                                      "role": "user",
+                                                      "content": prompt
+                                                  }],
+                                                  temperature=0.65,
+                                                  **additional_args)
+    if response_format:
+        return output
+    return output.choices[0].message.content
+
+
+async def ask_openai_async(prompt: str,
+                           model: str = "gpt-4o-mini-2024-07-18",
+                           response_format: Optional[BaseModel] = None):
+    additional_args = {}
+    client = get_client("openai", is_async=True)
+
+    fn = client.chat.completions.create
+    if response_format:
+        additional_args["response_format"] = response_format
+        fn = client.beta.chat.completions.parse
+
+    response = await fn(model=model,
+                        messages=[{
+                            "role": "user",
+                            "content": prompt
+                        }],
+                        **additional_args)
+    if response_format:
+        return response.choices[0].message.parsed
+    return response.choices[0].message.content
+
+
+async def ask_anthropic_async(prompt: str,
+                              model: str = "claude-3-5-haiku-latest",
+                              response_format: Optional[BaseModel] = None):
+    additional_args = {}
+    client = get_client("anthropic", is_async=True)
+    if response_format:
+        additional_args["response_model"] = response_format
+        client = get_instructor_client("anthropic", is_async=True)
+    output = await client.messages.create(model=model,
+                                          max_tokens=1024,
+                                          messages=[{
+                                              "role": "user",
+                                              "content": prompt
+                                          }],
+                                          **additional_args)
+    if response_format:
+        return output
+    return output.content[0].text
+
+
+PROVIDERS = {
+    "groq": (ask_groq, ask_groq_async),
+    "openai": (ask_openai, ask_openai_async),
+    "anthropic": (ask_anthropic, ask_anthropic_async),
+}
+
+DEFAULT_MODELS = {
+    "groq": "llama-3.3-70b-specdec",
+    "openai": "gpt-4o-mini-2024-07-18",
+    "anthropic": "claude-3-5-haiku-latest",
+}
+
+
+def get_provider(provider: Optional[str] = None):
+    provider = provider or LLM_PROVIDER
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {provider}")
+    get_api_key(provider)
+    return PROVIDERS[provider]
+
+
+def llm_cache_key(provider: str, model: str, prompt: str,
+                  response_format: Optional[BaseModel]):
+    schema = ""
+    if response_format:
+        schema = json.dumps(response_format.model_json_schema(),
+                            sort_keys=True)
+    return content_key(provider, model, prompt, schema)
+
+
+def dump_llm_output(output, response_format: Optional[BaseModel]):
+    if response_format:
+        return output.model_dump(mode="json")
+    return output
+
+
+def load_llm_output(value, response_format: Optional[BaseModel]):
+    if response_format:
+        return response_format.model_validate(value)
+    return value
+
+
+def record_usage(provider: str, prompt: str, output,
+                 response_format: Optional[BaseModel]):
+    # Only requests that reached the provider are counted, not cache hits.
+    completion = dump_llm_output(output, response_format)
+    if not isinstance(completion, str):
+        completion = json.dumps(completion)
+    for direction, text in (("prompt", prompt), ("completion", completion)):
+        counter("llm_tokens",
+                "Estimated tokens sent to and received from LLM providers",
+                provider=provider,
+                direction=direction).inc(estimate_tokens(text))
+        counter("llm_bytes",
+                "Bytes of prompts sent to and completions received from "
+                "LLM providers",
+                provider=provider,
+                direction=direction).inc(len(text.encode("utf-8")))
+
+
+def call_provider(provider: str, model: str, prompt: str,
+                  response_format: Optional[BaseModel]):
+    ask, _ = get_provider(provider)
+    output = provider_policies[provider].call(ask,
+                                              prompt,
+                                              model=model,
+                                              response_format=response_format)
+    record_usage(provider, prompt, output, response_format)
+    return output
+
+
+async def call_provider_async(provider: str, model: str, prompt: str,
+                              response_format: Optional[BaseModel]):
+    _, ask_async = get_provider(provider)
+    output = await provider_policies[provider].call_async(
+        ask_async, prompt, model=model, response_format=response_format)
+    record_usage(provider, prompt, output, response_format)
+    return output
+
+
+def is_available(provider: str):
+    try:
+        get_api_key(provider)
+    except ProviderNotConfiguredError:
+        return False
+    return provider_policies[provider].breaker.state != "open"
+
+
+# With LLM_PROVIDER=auto every call goes through the router, which picks a
+# provider/model from LLM_ROUTER_CANDIDATES per call.
+AUTO_PROVIDER = "auto"
+llm_router = LLMRouter(parse_candidates(LLM_ROUTER_CANDIDATES, DEFAULT_MODELS),
+                       is_available)
+
+
+def check_llm_configured(provider: Optional[str] = None):
+    # Raises ProviderNotConfiguredError if calls would fail for lack of a key.
+    provider = provider or LLM_PROVIDER
+    if provider == AUTO_PROVIDER:
+        llm_router.rank()
+    else:
+        get_provider(provider)
+
+
+def resolve_call(prompt: str, response_format: Optional[BaseModel],
+                 provider: Optional[str], model: Optional[str],
+                 is_async: bool):
+    # Returns the provider and model the call is cached under, and a
+    # function that makes it.
+    provider = provider or LLM_PROVIDER
+    if provider == AUTO_PROVIDER:
+        if is_async:
+            load = partial(llm_router.call_async, call_provider_async, prompt,
+                           response_format)
+        else:
+            load = partial(llm_router.call, call_provider, prompt,
+                           response_format)
+        return provider, "", load
+    get_provider(provider)
+    model = model or DEFAULT_MODELS.get(provider)
+    call = call_provider_async if is_async else call_provider
+    return provider, model, partial(call, provider, model, prompt,
+                                    response_format)
+
+
+def ask_llm(prompt: str,
+            response_format: Optional[BaseModel] = None,
+            provider: Optional[str] = None,
+            model: Optional[str] = None,
+            use_cache: bool = True):
+    provider, model, load_output = resolve_call(prompt, response_format,
+                                                provider, model, False)
+    with span("llm", provider=provider, model=model or None):
+        if not (use_cache and LLM_CACHE_ENABLED):
+            return load_output()
+        key = llm_cache_key(provider, model, prompt, response_format)
+        cached_output = llm_cache.get(key)
+        if cached_output is not None:
+            return load_llm_output(cached_output, response_format)
+
+        def load_and_cache_output():
+            output = load_output()
+            llm_cache.set(key, dump_llm_output(output, response_format))
+            return output
+
+        return llm_flight.do(key, load_and_cache_output)
+
+
+async def ask_llm_async(prompt: str,
+                        response_format: Optional[BaseModel] = None,
+                        provider: Optional[str] = None,
+                        model: Optional[str] = None,
+                        use_cache: bool = True):
+    provider, model, load_output = resolve_call(prompt, response_format,
+                                                provider, model, True)
+    with span("llm", provider=provider, model=model or None):
+        if not (use_cache and LLM_CACHE_ENABLED):
+            return await load_output()
+        key = llm_cache_key(provider, model, prompt, response_format)
+        cached_output = await llm_cache.get_async(key)
+        if cached_output is not None:
+            return load_llm_output(cached_output, response_format)
+
+        async def load_and_cache_output():
+            output = await load_output()
+            await llm_cache.set_async(key,
+                                      dump_llm_output(output, response_format))
+            return output
+
+        return await llm_flight.do_async(key, load_and_cache_output)
@@ -1,31 +1,64 @@
-import json
-from typing import List, Dict, Annotated, Union
-import uvicorn
-from fastapi import FastAPI, Depends
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Dict, Annotated, Literal, Optional, Union
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+import logging
+import os
 import uuid
 import src.python_backend.models as models
-from src.python_backend.database import engine, SessionLocal
+from src.python_backend.crud import SheetNotFoundError, VersionConflictError, patch_sheet, read_cell_range, read_sheet_contents, read_sheet_header, upsert_sheet
+from src.python_backend.migrations import run_migrations
+from src.python_backend.database import get_engine, SessionLocal, run_db
+from src.python_backend.metrics import registry
+from src.python_backend.brave import brave_policy, check_search_configured, search_cache, search_flight, SEARCH_CACHE_PERSIST
+from src.python_backend.cache import DatabaseCacheBackend
+from src.python_backend.llm import check_llm_configured, llm_cache, llm_flight, llm_router, provider_policies
+from src.python_backend.resilience import ProviderNotConfiguredError
 from sqlalchemy.orm import Session
-from src.python_backend.ai_functions import ai_get_suggested_columns, ai_autofill_index_col, ai_autofill_cells
-from pydantic import BaseModel
+from src.python_backend.ai_functions import ai_get_suggested_columns_async, ai_autofill_index_col_async, ai_autofill_index_col_stream, ai_autofill_cells_async, ai_autofill_cells_stream, ai_autofill_sheet_async
+from src.python_backend.scheduler import autofill_scheduler
+from src.python_backend.jobs import cancel_job, create_job, get_job_progress, job_runner
+from src.python_backend.serialization import FastJSONResponse, loads
+from src.python_backend.sheet_io import MEDIA_TYPES, export_sheet, import_sheet_stream
+from src.python_backend.tracing import configure_tracing, shutdown_tracing
+from pydantic import BaseModel, Field
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Only the backend's own loggers follow LOG_LEVEL; the SDKs and httpx log
+# every request at INFO.
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("src.python_backend").setLevel(LOG_LEVEL)
+logger = logging.getLogger(__name__)
 
 # Initialize the database
 
-models.Base.metadata.create_all(bind=engine)
+def init_database():
+    engine = get_engine()
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
+    if SEARCH_CACHE_PERSIST:
+        search_cache.backend = DatabaseCacheBackend(SessionLocal,
+                                                    models.SearchCacheEntry)
+        # Later writes prune again at most once an hour.
+        search_cache.prune()
 
 # Initialize the FastAPI app
 
-app = FastAPI()
+# Database setup runs at startup rather than on import, so importing the app
+# stays cheap.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_database()
+    configure_tracing()
+    await job_runner.start()
+    yield
+    await job_runner.stop()
+    shutdown_tracing()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = ['http://localhost:8000', 'http://localhost:8080']
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +68,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(ProviderNotConfiguredError)
+async def provider_not_configured(request: Request,
+                                  exc: ProviderNotConfiguredError):
+    return JSONResponse({"detail": str(exc)}, status_code=503)
+
+
+def check_providers_configured():
+    # A streaming response cannot become a 503 once it has started, so the
+    # streaming AI endpoints check for their keys up front.
+    check_llm_configured()
+    check_search_configured()
+
+
+def ndjson_response(lines: AsyncIterator[BaseModel]) -> StreamingResponse:
+
+    async def encode_lines():
+        async for line in lines:
+            yield line.model_dump_json(exclude_none=True) + "\n"
+
+    return StreamingResponse(encode_lines(), media_type="application/x-ndjson")
+
 # Endpoints
 
 @app.get("/")
@@ -42,6 +97,24 @@ async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(),
+                             media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return {
+        "search": search_cache.stats(),
+        "llm": llm_cache.stats(),
+        "in_flight": {
+            "search": search_flight.stats(),
+            "llm": llm_flight.stats()
+        },
+    }
+
+
 # Suggested columns endpoint
 
 class SuggestedColumnsRequest(BaseModel):
@@ -54,7 +127,7 @@ class SuggestedColumnsResponse(BaseModel):
 @app.post("/suggested-columns")
 async def get_suggested_columns(
         request: SuggestedColumnsRequest) -> SuggestedColumnsResponse:
-    columns = ai_get_suggested_columns(request.description)
+    columns = await ai_get_suggested_columns_async(request.description)
     return SuggestedColumnsResponse(results=columns)
 
 
@@ -73,18 +146,45 @@ class AutofillIndexColResponse(BaseModel):
 @app.post("/autofill-index")
 async def autofill_index_col(
         request: AutofillIndexColRequest) -> AutofillIndexColResponse:
-    values = ai_autofill_index_col(description=request.description,
-                                   col_name=request.col_name,
-                                   max_count=request.max_count)
+    values = await ai_autofill_index_col_async(
+        description=request.description,
+        col_name=request.col_name,
+        max_count=request.max_count)
     return AutofillIndexColResponse(results=values)
 
 
+class AutofillIndexColStreamEvent(BaseModel):
+    event: Literal["query", "value"]
+    query: Optional[str] = None
+    index: Optional[int] = None
+    value: Optional[str] = None
+
+
+@app.post("/autofill-index/stream")
+async def autofill_index_col_stream(
+        request: AutofillIndexColRequest) -> StreamingResponse:
+    check_providers_configured()
+
+    async def stream_events():
+        async for event in ai_autofill_index_col_stream(
+                description=request.description,
+                col_name=request.col_name,
+                max_count=request.max_count):
+            yield AutofillIndexColStreamEvent(**event)
+
+    return ndjson_response(stream_events())
+
+
 # Autofill cells endpoint
 
+ConsolidationMode = Literal["per_column", "batched"]
+
+
 class AutofillCellsRequest(BaseModel):
     description: str
     columns: List[str]
     index_value: str
+    consolidation: Optional[ConsolidationMode] = None
 
 
 class AutofillCellsResponse(BaseModel):
@@ -95,38 +195,255 @@ class AutofillCellsResponse(BaseModel):
 @app.post("/autofill-cells")
 async def autofill_cells(
         request: AutofillCellsRequest) -> AutofillCellsResponse:
-    values, sources = ai_autofill_cells(description=request.description,
-                                        selected_cols=request.columns,
-                                        index_value=request.index_value)
+    values, sources = await ai_autofill_cells_async(
+        description=request.description,
+        selected_cols=request.columns,
+        index_value=request.index_value,
+        consolidation=request.consolidation)
     return AutofillCellsResponse(values=values, sources=sources)
 
 
+class AutofillCellsStreamCell(BaseModel):
+    col: int
+    value: str
+    source: str
+
+
+@app.post("/autofill-cells/stream")
+async def autofill_cells_stream(
+        request: AutofillCellsRequest) -> StreamingResponse:
+    check_providers_configured()
+
+    async def stream_cells():
+        async for col, value, source in ai_autofill_cells_stream(
+                description=request.description,
+                selected_cols=request.columns,
+                index_value=request.index_value,
+                consolidation=request.consolidation):
+            yield AutofillCellsStreamCell(col=col, value=value, source=source)
+
+    return ndjson_response(stream_cells())
+
+
+# Autofill sheet endpoint
+
+class AutofillSheetRequest(BaseModel):
+    description: str
+    columns: List[str]
+    index_values: List[str]
+    consolidation: Optional[ConsolidationMode] = None
+
+
+class AutofillSheetCell(BaseModel):
+    row: int
+    col: int
+    value: str
+    source: str
+
+
+@app.post("/autofill-sheet")
+async def autofill_sheet(request: AutofillSheetRequest) -> StreamingResponse:
+    check_providers_configured()
+
+    async def stream_cells():
+        async for row, col, value, source in ai_autofill_sheet_async(
+                selected_cols=request.columns,
+                index_values=request.index_values,
+                description=request.description,
+                consolidation=request.consolidation):
+            yield AutofillSheetCell(row=row, col=col, value=value, source=source)
+
+    return ndjson_response(stream_cells())
+
+
+@app.get("/scheduler-stats")
+async def scheduler_stats():
+    return autofill_scheduler.stats()
+
+
+@app.get("/router-stats")
+async def router_stats():
+    return llm_router.stats()
+
+
+@app.get("/provider-stats")
+async def provider_stats():
+    policies = {**provider_policies, "brave": brave_policy}
+    return {name: policy.stats() for name, policy in policies.items()}
+
+
+# Autofill job endpoints
+
+class AutofillJobRequest(BaseModel):
+    sheet_id: str
+    description: Optional[str] = None
+    columns: Optional[List[int]] = None
+    rows: Optional[List[int]] = None
+    # "stale" only redoes empty cells and autofilled cells whose inputs
+    # changed or that are older than max_age seconds.
+    mode: Literal["all", "stale"] = "all"
+    max_age: Optional[float] = Field(None, ge=0)
+
+
+class AutofillJobResponse(BaseModel):
+    job_id: str
+
+
+class AutofillJobProgress(BaseModel):
+    id: str
+    sheet_id: str
+    status: str
+    total: int
+    counts: Dict[str, int]
+    created_at: float
+    updated_at: float
+
+
+class AutofillJobEvent(BaseModel):
+    event: Literal["cell", "done"]
+    row: Optional[int] = None
+    col: Optional[int] = None
+    status: Optional[str] = None
+    value: Optional[str] = None
+    source: Optional[str] = None
+    error: Optional[str] = None
+
+
+@app.post("/jobs/autofill")
+async def submit_autofill_job(
+        request: AutofillJobRequest) -> AutofillJobResponse:
+    try:
+        job_id = await run_db(create_job, request.sheet_id,
+                              request.description, request.columns,
+                              request.rows, request.mode, request.max_age)
+    except SheetNotFoundError:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job_runner.notify()
+    return AutofillJobResponse(job_id=job_id)
+
+
+@app.get("/jobs/{job_id}")
+async def get_autofill_job(job_id: str) -> AutofillJobProgress:
+    progress = await run_db(get_job_progress, job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return AutofillJobProgress(**progress)
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_autofill_job(job_id: str) -> AutofillJobProgress:
+    if await run_db(cancel_job, job_id):
+        job_runner.publish(job_id, {"event": "done"})
+    progress = await run_db(get_job_progress, job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return AutofillJobProgress(**progress)
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_autofill_job(job_id: str) -> StreamingResponse:
+    if await run_db(get_job_progress, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream_events():
+        async for event in job_runner.events(job_id):
+            yield AutofillJobEvent(**event)
+
+    return ndjson_response(stream_events())
+
+
+@app.get("/job-stats")
+async def job_stats():
+    return job_runner.stats()
+
+
 # Load sheets endpoint
 
 class LoadSheetsResponse(BaseModel):
     sheets: List[Dict]
 
 
-@app.get("/load-sheets")
-async def load_sheets(db: db_dependency) -> LoadSheetsResponse:
-    try:
-        sheets = db.query(models.Sheet).all()
-    except Exception as e:
-        print(f"Error loading sheets: {e}")
-        sheets = []
-    sheets = [{
+def serialize_sheet(db: Session, sheet: models.Sheet):
+    columns, data, sources = read_sheet_contents(db, sheet.id)
+    return {
         "id": sheet.id,
         "sheet": {
             "id": sheet.id,
             "title": sheet.title,
             "description": sheet.description,
             "indexColumn": sheet.index_column,
-            "columns": json.loads(sheet.columns),
-            "data": json.loads(sheet.data),
-            "sources": json.loads(sheet.sources),
+            "columns": columns,
+            "data": data,
+            "sources": sources,
+            "version": sheet.version,
         }
-    } for sheet in sheets]
-    return LoadSheetsResponse(sheets=sheets)
+    }
+
+
+# Sheet payloads are built from plain rows, so they are rendered directly
+# instead of being validated against the response model again.
+@app.get("/load-sheets", response_model=LoadSheetsResponse)
+async def load_sheets() -> FastJSONResponse:
+
+    def read_sheets(db: Session):
+        try:
+            sheets = db.query(models.Sheet).all()
+        except Exception as e:
+            logger.warning("Error loading sheets: %s", e)
+            sheets = []
+        return [serialize_sheet(db, sheet) for sheet in sheets]
+
+    return FastJSONResponse({"sheets": await run_db(read_sheets)})
+
+
+# List sheets endpoint
+
+class SheetSummary(BaseModel):
+    id: str
+    title: Optional[str]
+    description: Optional[str]
+
+
+class ListSheetsResponse(BaseModel):
+    sheets: List[SheetSummary]
+    next_cursor: Optional[str] = None
+
+
+@app.get("/sheets")
+async def list_sheets(cursor: Optional[str] = None,
+                      limit: int = Query(50, ge=1, le=200)) -> ListSheetsResponse:
+
+    def read_page(db: Session):
+        query = db.query(models.Sheet.id, models.Sheet.title,
+                         models.Sheet.description).order_by(models.Sheet.id)
+        if cursor:
+            query = query.filter(models.Sheet.id > cursor)
+        return query.limit(limit + 1).all()
+
+    rows = await run_db(read_page)
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    sheets = [
+        SheetSummary(id=row.id, title=row.title, description=row.description)
+        for row in rows[:limit]
+    ]
+    return ListSheetsResponse(sheets=sheets, next_cursor=next_cursor)
+
+
+# Get sheet endpoint
+
+@app.get("/sheets/{sheet_id}", response_model=Dict)
+async def get_sheet(sheet_id: str) -> FastJSONResponse:
+
+    def read_sheet(db: Session):
+        sheet = db.get(models.Sheet, sheet_id)
+        return None if sheet is None else serialize_sheet(db, sheet)
+
+    sheet = await run_db(read_sheet)
+    if sheet is None:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+    return FastJSONResponse(sheet)
 
 
 # Save sheet endpoint
@@ -137,33 +454,163 @@ class SaveSheetRequest(BaseModel):
 
 
 @app.post("/save-sheet")
-async def save_sheet(request: SaveSheetRequest, db: db_dependency) -> None:
+async def save_sheet(request: SaveSheetRequest) -> None:
     if isinstance(request.sheet, str):
-        sheet = json.loads(request.sheet)
+        sheet = loads(request.sheet)
     else:
         sheet = request.sheet
-    sheet_data = {
-        'id': sheet.get("id", str(uuid.uuid4())),
-        'title': sheet.get("title", ""),
-        'description': sheet.get("description", ""),
-        'index_column': sheet.get("indexColumn", ""),
-        'columns': json.dumps(sheet.get("columns", [])),
-        'data': json.dumps(sheet.get("data", [])),
-        'sources': json.dumps(sheet.get("sources", []))
-    }
+    sheet["id"] = sheet.get("id", str(uuid.uuid4()))
+    await run_db(upsert_sheet, sheet)
+
+
+# Sheet export and import endpoints
+
+@app.get("/sheets/{sheet_id}/export")
+async def export_sheet_file(
+        sheet_id: str,
+        format: Literal["csv", "ndjson"] = "csv") -> StreamingResponse:
+    header = await run_db(read_sheet_header, sheet_id)
+    if header is None:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+    return StreamingResponse(
+        export_sheet(header, format),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition":
+            f'attachment; filename="{sheet_id}.{format}"'
+        })
+
+
+class ImportSheetResponse(BaseModel):
+    rows: int
+    version: int
+
+
+@app.post("/sheets/{sheet_id}/import")
+async def import_sheet_file(
+        sheet_id: str,
+        request: Request,
+        format: Literal["csv", "ndjson"] = "csv",
+        title: Optional[str] = None,
+        description: Optional[str] = None,
+        index_column: Optional[str] = None) -> ImportSheetResponse:
+    try:
+        rows, version = await import_sheet_stream(sheet_id, request.stream(),
+                                                  format, title, description,
+                                                  index_column)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ImportSheetResponse(rows=rows, version=version)
 
-    existing_sheet = db.query(models.Sheet).filter(
-        models.Sheet.id == sheet_data["id"]).first()
 
-    if existing_sheet:
-        for key, value in sheet_data.items():
-            setattr(existing_sheet, key, value)
-    else:
-        db.add(models.Sheet(**sheet_data))
-    db.commit()
+# Sheet cell range endpoint
+
+class SheetCell(BaseModel):
+    row: int
+    col: int
+    value: str
+    source: str
+    query: Optional[str] = None
+    fetched_at: Optional[float] = None
+
+
+class SheetCellsResponse(BaseModel):
+    cells: List[SheetCell]
+
+
+@app.get("/sheets/{sheet_id}/cells")
+async def get_sheet_cells(sheet_id: str,
+                          row_start: int = Query(0, ge=0),
+                          row_end: int = Query(100, ge=0),
+                          col_start: int = Query(0, ge=0),
+                          col_end: int = Query(1000, ge=0)) -> SheetCellsResponse:
+    cells = await run_db(read_cell_range, sheet_id, row_start, row_end,
+                         col_start, col_end)
+    return SheetCellsResponse(cells=[
+        SheetCell(row=row,
+                  col=col,
+                  value=value,
+                  source=source,
+                  query=query,
+                  fetched_at=fetched_at)
+        for row, col, value, source, query, fetched_at in cells
+    ])
+
+
+# Patch sheet endpoint
+
+class SetCellOp(BaseModel):
+    op: Literal["set_cell"]
+    row: int
+    col: int
+    value: Optional[str] = None
+    source: Optional[str] = None
+
+
+class InsertRowOp(BaseModel):
+    op: Literal["insert_row"]
+    row: int
+    values: Optional[List[str]] = None
+    sources: Optional[List[str]] = None
+
+
+class DeleteRowOp(BaseModel):
+    op: Literal["delete_row"]
+    row: int
+
+
+class InsertColumnOp(BaseModel):
+    op: Literal["insert_column"]
+    col: int
+    name: str
+
+
+class DeleteColumnOp(BaseModel):
+    op: Literal["delete_column"]
+    col: int
+
+
+class RenameColumnOp(BaseModel):
+    op: Literal["rename_column"]
+    col: int
+    name: str
+
+
+SheetOp = Annotated[Union[SetCellOp, InsertRowOp, DeleteRowOp, InsertColumnOp,
+                          DeleteColumnOp, RenameColumnOp],
+                    Field(discriminator="op")]
+
+
+class PatchSheetRequest(BaseModel):
+    version: int
+    ops: List[SheetOp]
+
+
+class PatchSheetResponse(BaseModel):
+    version: int
+
+
+@app.patch("/sheets/{sheet_id}")
+async def patch_sheet_cells(sheet_id: str,
+                            request: PatchSheetRequest) -> PatchSheetResponse:
+    try:
+        version = await run_db(patch_sheet, sheet_id, request.version,
+                               request.ops)
+    except SheetNotFoundError:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+    except VersionConflictError as e:
+        raise HTTPException(status_code=409,
+                            detail={
+                                "message": "Sheet was modified",
+                                "version": e.current_version
+                            })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return PatchSheetResponse(version=version)
 
 
 def main():
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
 
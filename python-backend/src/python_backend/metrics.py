@@ -0,0 +1,148 @@
+from bisect import bisect_left
+from typing import Callable, Dict, Tuple
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(labels: Dict[str, str]):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def format_value(value: float):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Dict[str, str]):
+        self.name = name
+        # The text format names a counter family after its _total sample.
+        self.family = f"{name}_total"
+        self.help = help
+        self.labels = labels
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.family, self.labels, self.value)]
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Dict[str, str],
+                 fn: Callable[[], float]):
+        self.name = name
+        self.family = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+
+    def samples(self):
+        return [(self.name, self.labels, self.fn())]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 help: str,
+                 labels: Dict[str, str],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.family = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"), ),
+                                       counts):
+            cumulative += bucket_count
+            samples.append((f"{self.name}_bucket", {
+                **self.labels, "le": format_value(bound)
+            }, cumulative))
+        samples.append((f"{self.name}_sum", self.labels, total))
+        samples.append((f"{self.name}_count", self.labels, count))
+        return samples
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get_or_create(self, cls, name: str, help: str, labels: Dict[str, str],
+                      **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = cls(name, help, labels, **kwargs)
+                self.metrics[key] = metric
+            return metric
+
+    def render(self):
+        # Prometheus text exposition format, one HELP/TYPE header per name.
+        lines = []
+        seen = set()
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.family)
+        for metric in metrics:
+            if metric.family not in seen:
+                seen.add(metric.family)
+                lines.append(f"# HELP {metric.family} {metric.help}")
+                lines.append(f"# TYPE {metric.family} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(
+                    f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, help: str, **labels: str) -> Counter:
+    return registry.get_or_create(Counter, name, help, labels)
+
+
+def gauge(name: str, help: str, fn: Callable[[], float],
+          **labels: str) -> Gauge:
+    return registry.get_or_create(Gauge, name, help, labels, fn=fn)
+
+
+def histogram(name: str,
+              help: str,
+              buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+              **labels: str) -> Histogram:
+    return registry.get_or_create(Histogram, name, help, labels,
+                                  buckets=buckets)
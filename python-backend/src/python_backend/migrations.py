@@ -0,0 +1,65 @@
+from sqlalchemy import inspect, null, or_, select, text, update
+import logging
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import src.python_backend.models as models
+from src.python_backend.crud import decode_json, replace_sheet_contents
+
+logger = logging.getLogger(__name__)
+
+# Columns added to existing tables after they were first created. create_all
+# only creates missing tables, so these are added in place on startup.
+ADDED_COLUMNS = [
+    ("sheets", "version", "INTEGER NOT NULL DEFAULT 0"),
+    ("cells", "query", "TEXT"),
+    ("cells", "input_hash", "VARCHAR"),
+    ("cells", "fetched_at", "FLOAT"),
+    ("autofill_tasks", "owner", "VARCHAR"),
+    ("autofill_jobs", "mode", "VARCHAR NOT NULL DEFAULT 'all'"),
+]
+
+
+def add_missing_columns(engine: Engine):
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                connection.execute(
+                    text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def migrate_sheet_blobs(engine: Engine):
+    # Moves sheets saved before the normalized schema out of their JSON
+    # blobs, one sheet per transaction, and clears the blobs once copied.
+    with Session(engine) as db:
+        sheet_ids = list(
+            db.scalars(
+                select(models.Sheet.id).where(
+                    or_(models.Sheet.columns.isnot(None),
+                        models.Sheet.data.isnot(None)))))
+    for sheet_id in sheet_ids:
+        with Session(engine) as db:
+            sheet = db.get(models.Sheet, sheet_id)
+            replace_sheet_contents(db, sheet_id,
+                                   decode_json(sheet.columns) or [],
+                                   decode_json(sheet.data) or [],
+                                   decode_json(sheet.sources) or [])
+            db.execute(
+                update(models.Sheet).where(models.Sheet.id == sheet_id).values(
+                    columns=null(), data=null(), sources=null()))
+            db.commit()
+        logger.info("Migrated sheet %s to normalized cell storage", sheet_id)
+
+
+def run_migrations(engine: Engine):
+    add_missing_columns(engine)
+    migrate_sheet_blobs(engine)
+
+
+if __name__ == "__main__":
+    from src.python_backend.database import get_engine
+    logging.basicConfig(level=logging.INFO)
+    engine = get_engine()
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, JSON
+from sqlalchemy import Column, String, JSON, Float, Integer, Text, ForeignKey, Index
 from src.python_backend.database import Base
 
 class Sheet(Base):
@@ -7,6 +7,90 @@ class Sheet(Base):
     title = Column(String)
     description = Column(String)
     index_column = Column(String, nullable=True)
-    columns = Column(JSON)
-    data = Column(JSON)
-    sources = Column(JSON, nullable=True)
\ No newline at end of file
+    # Legacy JSON blobs. Their contents are moved into sheet_columns,
+    # sheet_rows and cells by migrations.migrate_sheet_blobs.
+    columns = Column(JSON, nullable=True)
+    data = Column(JSON, nullable=True)
+    sources = Column(JSON, nullable=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class SheetColumn(Base):
+    __tablename__ = "sheet_columns"
+    sheet_id = Column(String,
+                      ForeignKey("sheets.id", ondelete="CASCADE"),
+                      primary_key=True)
+    position = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+
+
+class SheetRow(Base):
+    __tablename__ = "sheet_rows"
+    sheet_id = Column(String,
+                      ForeignKey("sheets.id", ondelete="CASCADE"),
+                      primary_key=True)
+    position = Column(Integer, primary_key=True)
+
+
+class Cell(Base):
+    __tablename__ = "cells"
+    # The composite primary key doubles as the (sheet_id, row, col) index.
+    sheet_id = Column(String,
+                      ForeignKey("sheets.id", ondelete="CASCADE"),
+                      primary_key=True)
+    row_index = Column(Integer, primary_key=True)
+    col_index = Column(Integer, primary_key=True)
+    value = Column(Text, nullable=False, default="")
+    source = Column(Text, nullable=False, default="")
+    # Provenance of a value written by an autofill job: the search query,
+    # a hash of the inputs it was researched from and when. Cleared when
+    # the value is edited by hand.
+    query = Column(Text, nullable=True)
+    input_hash = Column(String, nullable=True)
+    fetched_at = Column(Float, nullable=True)
+
+
+class AutofillJob(Base):
+    __tablename__ = "autofill_jobs"
+    id = Column(String, primary_key=True)
+    sheet_id = Column(String,
+                      ForeignKey("sheets.id", ondelete="CASCADE"),
+                      index=True)
+    description = Column(Text, nullable=False, default="")
+    index_col = Column(Integer, nullable=False)
+    # "all" or "stale"; stale re-fills skip the search and LLM caches.
+    mode = Column(String, nullable=False, default="all", server_default="all")
+    status = Column(String, nullable=False)
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+
+class AutofillTask(Base):
+    __tablename__ = "autofill_tasks"
+    __table_args__ = (Index("ix_autofill_tasks_status_row", "status", "job_id",
+                            "row_index"), )
+    job_id = Column(String,
+                    ForeignKey("autofill_jobs.id", ondelete="CASCADE"),
+                    primary_key=True)
+    row_index = Column(Integer, primary_key=True)
+    col_index = Column(Integer, primary_key=True)
+    index_value = Column(Text, nullable=False)
+    col_name = Column(String, nullable=False)
+    # Generated once per row and kept, so a resumed task skips the LLM call.
+    query = Column(Text, nullable=True)
+    status = Column(String, nullable=False)
+    # Worker process holding a running task; its claim lapses when
+    # updated_at is older than the lease.
+    owner = Column(String, nullable=True)
+    value = Column(Text, nullable=True)
+    source = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    updated_at = Column(Float, nullable=False)
+
+
+class SearchCacheEntry(Base):
+    __tablename__ = "search_cache"
+    key = Column(String, primary_key=True)
+    label = Column(String)
+    value = Column(JSON)
+    created_at = Column(Float, index=True)
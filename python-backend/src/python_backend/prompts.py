@@ -148,3 +148,41 @@ Search results:
 class CellFillInformationConsolidationResponse(BaseModel):
     answer: str
     sources: List[str]
+
+
+CELL_FILL_BATCH_CONSOLIDATION_PROMPT = '''
+You are given the following things:
+- description of the task that the user wants to do.
+- element that the user cares about
+- a list of cells, each with the aspect of the element that the user wants to learn about, the query that was used to search the web and the search results
+
+Your goal is to consolidate the search results of each cell into a single answer for that cell and provide the url for the sources. Only use a cell's own search results to answer it. Your output should be concise. Think step by step to consolidate the search results. Use good judgement to make sure the output you get is valid and accurate.
+
+The current date is {current_date}. Use this date if it's relevant to the user request (for instance, when age is relevant or when the user asks about company revenue for a certain year).
+
+For example, if the inputs looks like:
+
+{{"description": "I want to learn about companies", "element": "google", "cells": [{{"aspect": "revenue", "query": "what is the revenue of google?", "search_results": "google made 100 billion dollars in revenue last year."}}, {{"aspect": "company_age", "query": "how old is google?", "search_results": "google was founded on 1998-09-04."}}]}}
+
+Your output should be:
+
+{{"answers": [{{"answer": "$100 billion", "sources": ["<url that helped you get the answer>"]}}, {{"answer": "26 years", "sources": ["<url that helped you get the answer>"]}}]}}
+
+The answers shouldn't be elaborate.
+- Return exactly one answer per cell, in the same order as the cells.
+- For numbers, just return the number with any modifiers (like dollars, years, etc).
+- For dates, return the date in the format YYYY-MM-DD. 
+- For other information, summarize the information in a concise manner (less than 2 sentences).
+- Do not include unnecessary information in the response (like "As of {current_date}...")
+- If the answer is unclear, just return "unknown"
+
+For the URLs, provide all of the urls of the sources that helped you get each answer.
+
+Here is the input:
+
+{input_dict}
+'''
+
+
+class CellFillBatchConsolidationResponse(BaseModel):
+    answers: List[CellFillInformationConsolidationResponse]
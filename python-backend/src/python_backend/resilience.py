@@ -0,0 +1,256 @@
+from typing import Optional, Tuple, Type
+import asyncio
+import os
+import random
+import threading
+import time
+from src.python_backend.metrics import counter, histogram
+from src.python_backend.ratelimit import TokenBucket
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class ProviderNotConfiguredError(Exception):
+    # Raised when a provider is selected but its API key is not set.
+    pass
+
+
+def iter_causes(exc: BaseException):
+    # SDK wrappers (instructor, tenacity) hide the provider error behind
+    # their own exception types, so walk everything that might hold it.
+    seen = set()
+    pending = [exc]
+    while pending:
+        current = pending.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        yield current
+        pending.extend([current.__cause__, current.__context__])
+        pending.extend(arg for arg in current.args
+                       if isinstance(arg, BaseException))
+        last_attempt = getattr(current, "last_attempt", None)
+        if last_attempt is not None:
+            pending.append(last_attempt.exception())
+
+
+def get_status_code(exc: BaseException):
+    status_code = getattr(exc, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(exc, "response", None), "status_code",
+                              None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def get_retry_after(exc: BaseException):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+        raise CircuitOpenError("circuit is open")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def abandon_trial(self):
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.failure_threshold > 0
+                                        and self.failures
+                                        >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+class ProviderPolicy:
+
+    def __init__(self,
+                 name: str,
+                 rate_limit: float,
+                 max_attempts: int = 3,
+                 base_delay: float = 0.5,
+                 max_delay: float = 20.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 retry_on: Tuple[Type[BaseException], ...] = ()):
+        self.name = name
+        self.rate_limiter = TokenBucket(rate_limit)
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.retry_on = retry_on
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def is_retryable(self, exc: BaseException):
+        for cause in iter_causes(exc):
+            status_code = get_status_code(cause)
+            if status_code is not None:
+                return status_code in RETRYABLE_STATUS_CODES
+            if isinstance(cause, self.retry_on + (TimeoutError,
+                                                  ConnectionError)):
+                return True
+        return False
+
+    def backoff(self, attempt: int, exc: BaseException):
+        delay = random.uniform(0, min(self.max_delay,
+                                      self.base_delay * 2**attempt))
+        for cause in iter_causes(exc):
+            retry_after = get_retry_after(cause)
+            if retry_after is not None:
+                return min(max(delay, retry_after), self.max_delay)
+        return delay
+
+    def before_attempt(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.rejected += 1
+            counter("provider_rejected",
+                    "Calls failed fast because the circuit was open",
+                    provider=self.name).inc()
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        self.calls += 1
+
+    def after_failure(self, attempt: int, exc: BaseException):
+        if not self.is_retryable(exc):
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        if attempt + 1 >= self.max_attempts:
+            self.failures += 1
+            counter("provider_failures",
+                    "Calls that failed after their last retry",
+                    provider=self.name).inc()
+            return None
+        self.retries += 1
+        counter("provider_retries", "Retried provider requests",
+                provider=self.name).inc()
+        return self.backoff(attempt, exc)
+
+    def record_request(self, seconds: float, outcome: str):
+        histogram("provider_request_seconds",
+                  "Latency of single provider requests, without retries",
+                  provider=self.name,
+                  outcome=outcome).observe(seconds)
+
+    def record_wait(self, seconds: float):
+        histogram("provider_rate_limit_wait_seconds",
+                  "Seconds spent waiting on the client-side rate limit",
+                  provider=self.name).observe(seconds)
+
+    # The rate limit is waited on before the breaker is asked, so a
+    # half-open breaker's trial is only taken once the request can go out;
+    # a caller cancelled while waiting never holds it.
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(self.max_attempts):
+            start = time.perf_counter()
+            self.rate_limiter.acquire()
+            self.record_wait(time.perf_counter() - start)
+            self.before_attempt()
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.record_request(time.perf_counter() - start, "error")
+                delay = self.after_failure(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.record_request(time.perf_counter() - start, "ok")
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        for attempt in range(self.max_attempts):
+            start = time.perf_counter()
+            await self.rate_limiter.acquire_async()
+            self.record_wait(time.perf_counter() - start)
+            self.before_attempt()
+            start = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except asyncio.CancelledError:
+                self.breaker.abandon_trial()
+                raise
+            except Exception as e:
+                self.record_request(time.perf_counter() - start, "error")
+                delay = self.after_failure(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.record_request(time.perf_counter() - start, "ok")
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "circuit": self.breaker.state,
+            "rate_limit": self.rate_limiter.rate,
+        }
+
+
+def policy_from_env(name: str,
+                    rate_limit: float,
+                    retry_on: Tuple[Type[BaseException], ...] = ()):
+    prefix = name.upper()
+    return ProviderPolicy(
+        name,
+        rate_limit=float(os.getenv(f"{prefix}_RATE_LIMIT", str(rate_limit))),
+        max_attempts=int(os.getenv(f"{prefix}_MAX_ATTEMPTS", "3")),
+        base_delay=float(os.getenv(f"{prefix}_RETRY_BASE_DELAY", "0.5")),
+        max_delay=float(os.getenv(f"{prefix}_RETRY_MAX_DELAY", "20")),
+        failure_threshold=int(
+            os.getenv(f"{prefix}_CIRCUIT_FAILURE_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv(f"{prefix}_CIRCUIT_RESET_TIMEOUT",
+                                      "30")),
+        retry_on=retry_on)
@@ -0,0 +1,272 @@
+from collections import deque
+from typing import Callable, Dict, List, NamedTuple, Optional
+import asyncio
+import os
+import random
+import threading
+import time
+from src.python_backend.metrics import counter
+from src.python_backend.resilience import ProviderNotConfiguredError
+
+LLM_ROUTER_CANDIDATES = os.getenv("LLM_ROUTER_CANDIDATES", "")
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "50"))
+LLM_ROUTER_WINDOW_SECONDS = float(os.getenv("LLM_ROUTER_WINDOW_SECONDS",
+                                            "300"))
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE",
+                                            "0.5"))
+LLM_ROUTER_EXPLORE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))
+LLM_ROUTER_HEDGE = os.getenv("LLM_ROUTER_HEDGE",
+                             "false").lower() in ("1", "true", "yes")
+LLM_ROUTER_HEDGE_PERCENTILE = float(
+    os.getenv("LLM_ROUTER_HEDGE_PERCENTILE", "0.95"))
+LLM_ROUTER_HEDGE_MIN_SAMPLES = int(
+    os.getenv("LLM_ROUTER_HEDGE_MIN_SAMPLES", "10"))
+
+
+class Candidate(NamedTuple):
+    provider: str
+    model: str
+
+    def __str__(self):
+        return f"{self.provider}:{self.model}"
+
+
+def parse_candidates(value: str, default_models: Dict[str, str]):
+    # "anthropic,openai:gpt-4o-mini" -> provider/model pairs; a provider
+    # without a model uses its default. Empty means every provider.
+    candidates = []
+    for entry in value.split(",") if value.strip() else default_models:
+        provider, _, model = entry.strip().partition(":")
+        if provider not in default_models:
+            raise ValueError(f"Unknown LLM provider in router: {provider}")
+        candidates.append(Candidate(provider, model or
+                                    default_models[provider]))
+    return candidates
+
+
+def percentile(values: List[float], fraction: float):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class RollingStats:
+    # Latencies and outcomes of the last `size` calls within `max_age`
+    # seconds, so a provider that failed or slowed down is judged on recent
+    # traffic and recovers once old samples age out.
+
+    def __init__(self, size: int, max_age: float):
+        self.max_age = max_age
+        self.latencies = deque(maxlen=size)
+        self.outcomes = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def prune(self, samples: deque):
+        cutoff = time.monotonic() - self.max_age
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+
+    def record_latency(self, seconds: float):
+        with self.lock:
+            self.latencies.append((time.monotonic(), seconds))
+
+    def record_outcome(self, ok: bool):
+        with self.lock:
+            self.outcomes.append((time.monotonic(), ok))
+
+    def latency_samples(self):
+        with self.lock:
+            self.prune(self.latencies)
+            return [seconds for _, seconds in self.latencies]
+
+    def error_rate(self):
+        with self.lock:
+            self.prune(self.outcomes)
+            if not self.outcomes:
+                return 0.0
+            return sum(not ok for _, ok in self.outcomes) / len(self.outcomes)
+
+    def latency(self, fraction: float):
+        samples = self.latency_samples()
+        return percentile(samples, fraction) if samples else None
+
+
+class LLMRouter:
+    """Sends each call to the fastest healthy provider/model by recent
+    median latency, and optionally hedges: if the call is still running at
+    that candidate's recent p95, the next best one is asked too and the
+    first answer wins. A failed call is retried once on the next best."""
+
+    def __init__(self,
+                 candidates: List[Candidate],
+                 is_available: Callable[[str], bool],
+                 hedge: bool = LLM_ROUTER_HEDGE,
+                 hedge_percentile: float = LLM_ROUTER_HEDGE_PERCENTILE,
+                 hedge_min_samples: int = LLM_ROUTER_HEDGE_MIN_SAMPLES,
+                 max_error_rate: float = LLM_ROUTER_MAX_ERROR_RATE,
+                 explore: float = LLM_ROUTER_EXPLORE,
+                 window: int = LLM_ROUTER_WINDOW,
+                 window_seconds: float = LLM_ROUTER_WINDOW_SECONDS):
+        self.candidates = candidates
+        self.is_available = is_available
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_error_rate = max_error_rate
+        self.explore = explore
+        self.windows = {
+            candidate: RollingStats(window, window_seconds)
+            for candidate in candidates
+        }
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def is_healthy(self, candidate: Candidate):
+        return self.windows[candidate].error_rate() <= self.max_error_rate
+
+    def rank(self):
+        available = [
+            candidate for candidate in self.candidates
+            if self.is_available(candidate.provider)
+        ]
+        if not available:
+            raise ProviderNotConfiguredError(
+                "No LLM provider is configured and reachable for "
+                "LLM_PROVIDER=auto")
+        healthy = [c for c in available if self.is_healthy(c)] or available
+        # Candidates without samples sort first so each gets measured.
+        ranked = sorted(
+            healthy,
+            key=lambda c: self.windows[c].latency(0.5) or 0.0) + [
+                c for c in available if c not in healthy
+            ]
+        # Now and then try another candidate (unhealthy ones included) so
+        # their stats keep up with how they are doing now.
+        if len(ranked) > 1 and random.random() < self.explore:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def hedge_delay(self, candidate: Candidate) -> Optional[float]:
+        if not self.hedge:
+            return None
+        samples = self.windows[candidate].latency_samples()
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return percentile(samples, self.hedge_percentile)
+
+    def record_selection(self, candidate: Candidate, reason: str):
+        counter("llm_router_calls",
+                "LLM calls sent by the router",
+                provider=candidate.provider,
+                model=candidate.model,
+                reason=reason).inc()
+
+    def call(self, fn, *args, **kwargs):
+        # fn(provider, model, *args, **kwargs). Synchronous calls fail over
+        # but are not hedged.
+        ranked = self.rank()
+        try:
+            return self.run(ranked[0], "primary", fn, *args, **kwargs)
+        except Exception:
+            if len(ranked) < 2:
+                raise
+        self.failovers += 1
+        return self.run(ranked[1], "failover", fn, *args, **kwargs)
+
+    def run(self, candidate: Candidate, reason: str, fn, *args, **kwargs):
+        self.record_selection(candidate, reason)
+        window = self.windows[candidate]
+        start = time.perf_counter()
+        try:
+            result = fn(candidate.provider, candidate.model, *args, **kwargs)
+        except Exception:
+            window.record_outcome(False)
+            raise
+        window.record_latency(time.perf_counter() - start)
+        window.record_outcome(True)
+        return result
+
+    async def run_async(self, candidate: Candidate, reason: str, fn, *args,
+                        **kwargs):
+        self.record_selection(candidate, reason)
+        window = self.windows[candidate]
+        start = time.perf_counter()
+        try:
+            result = await fn(candidate.provider, candidate.model, *args,
+                              **kwargs)
+        except asyncio.CancelledError:
+            # Lost a hedge: it took at least this long.
+            window.record_latency(time.perf_counter() - start)
+            raise
+        except Exception:
+            window.record_outcome(False)
+            raise
+        window.record_latency(time.perf_counter() - start)
+        window.record_outcome(True)
+        return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        ranked = self.rank()
+        primary = ranked[0]
+        # Hedges go to the next best candidate, or repeat the request when
+        # there is only one.
+        backup = ranked[1] if len(ranked) > 1 else primary
+        tasks = {
+            asyncio.create_task(
+                self.run_async(primary, "primary", fn, *args, **kwargs)):
+            "primary"
+        }
+        hedge_delay = self.hedge_delay(primary)
+        backup_started = False
+        error = None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=None if backup_started else hedge_delay,
+                    return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    role = tasks.pop(task)
+                    if task.exception() is None:
+                        if role == "hedge":
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                if backup_started:
+                    continue
+                if done:
+                    # The primary failed before the hedge deadline.
+                    if len(ranked) < 2:
+                        break
+                    role = "failover"
+                    self.failovers += 1
+                else:
+                    role = "hedge"
+                    self.hedges += 1
+                backup_started = True
+                tasks[asyncio.create_task(
+                    self.run_async(backup, role, fn, *args, **kwargs))] = role
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "candidates": {
+                str(candidate): {
+                    "available": self.is_available(candidate.provider),
+                    "healthy": self.is_healthy(candidate),
+                    "samples": len(window.latency_samples()),
+                    "p50": window.latency(0.5),
+                    "p95": window.latency(0.95),
+                    "error_rate": window.error_rate(),
+                }
+                for candidate, window in self.windows.items()
+            },
+            "hedge": self.hedge,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+        }
@@ -0,0 +1,43 @@
+import asyncio
+import os
+
+AUTOFILL_SCHEDULER_CONCURRENCY = int(
+    os.getenv("AUTOFILL_SCHEDULER_CONCURRENCY", "32"))
+
+
+class Scheduler:
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+
+    async def run(self, fn, *args, **kwargs):
+        self.queued += 1
+        acquired = False
+        try:
+            async with self.semaphore:
+                self.queued -= 1
+                acquired = True
+                self.running += 1
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.running -= 1
+                    self.completed += 1
+        finally:
+            if not acquired:
+                self.queued -= 1
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+        }
+
+
+autofill_scheduler = Scheduler(AUTOFILL_SCHEDULER_CONCURRENCY)
@@ -0,0 +1,37 @@
+from typing import Any
+import json
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content,
+                      ensure_ascii=False,
+                      allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def dumps_text(content: Any) -> str:
+    # SQLAlchemy's json_serializer has to return str.
+    return dumps(content).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    # Renders plain dicts and lists in one pass, skipping the Pydantic
+    # validation and jsonable_encoder walk FastAPI does for return values.
+    # Endpoints returning it should still set response_model for the docs.
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
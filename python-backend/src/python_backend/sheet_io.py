@@ -0,0 +1,164 @@
+from typing import AsyncIterator, Dict, Iterator, Optional
+import codecs
+import csv
+import io
+import os
+import anyio
+from fastapi.concurrency import run_in_threadpool
+from src.python_backend.crud import import_sheet, read_row_range
+from src.python_backend.database import run_db, with_session
+from src.python_backend.serialization import dumps, loads
+
+# Rows read from or written to the database at a time by sheet exports and
+# imports; memory use follows this, not the size of the sheet.
+SHEET_TRANSFER_CHUNK_ROWS = int(os.getenv("SHEET_TRANSFER_CHUNK_ROWS",
+                                          "1000"))
+
+CSV = "csv"
+NDJSON = "ndjson"
+MEDIA_TYPES = {CSV: "text/csv; charset=utf-8", NDJSON: "application/x-ndjson"}
+
+# NDJSON exports start with this header line, followed by one
+# {"values": [...], "sources": [...]} line per row. CSV exports are the
+# column names followed by the values.
+HEADER_FIELDS = ("id", "title", "description", "indexColumn", "columns")
+
+
+async def export_rows(header: Dict, chunk_rows: int):
+    # Each chunk is read in its own short session, so a slow download holds
+    # neither the sheet in memory nor a pooled connection. Edits made while
+    # the export runs can show up in rows not read yet.
+    row_count, column_count = header["rowCount"], len(header["columns"])
+    for start in range(0, row_count, chunk_rows):
+        yield await run_db(read_row_range, header["id"], start,
+                           min(start + chunk_rows, row_count), column_count)
+
+
+async def export_csv(header: Dict,
+                     chunk_rows: int = SHEET_TRANSFER_CHUNK_ROWS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header["columns"])
+    yield buffer.getvalue()
+    async for data, _ in export_rows(header, chunk_rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(data)
+        yield buffer.getvalue()
+
+
+async def export_ndjson(header: Dict,
+                        chunk_rows: int = SHEET_TRANSFER_CHUNK_ROWS):
+    yield dumps({field: header[field] for field in HEADER_FIELDS}) + b"\n"
+    async for data, sources in export_rows(header, chunk_rows):
+        yield b"".join(
+            dumps({
+                "values": values,
+                "sources": row_sources
+            }) + b"\n" for values, row_sources in zip(data, sources))
+
+
+def export_sheet(header: Dict, format: str):
+    if format == CSV:
+        return export_csv(header)
+    return export_ndjson(header)
+
+
+def body_lines(chunks: AsyncIterator[bytes]) -> Iterator[str]:
+    # Text lines of the request body for code running in a worker thread.
+    # Each chunk is received on the event loop as the import asks for it,
+    # so only one chunk and one line are held at a time.
+
+    async def next_chunk():
+        return await anext(chunks, None)
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    while (chunk := anyio.from_thread.run(next_chunk)) is not None:
+        *lines, pending = (pending + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def read_csv(lines: Iterator[str]):
+    reader = csv.reader(lines)
+
+    def rows():
+        try:
+            for values in reader:
+                yield values, []
+        except csv.Error as e:
+            raise ValueError(f"Invalid CSV on line {reader.line_num}: {e}")
+
+    try:
+        columns = next(reader)
+    except StopIteration:
+        columns = []
+    except csv.Error as e:
+        raise ValueError(f"Invalid CSV header: {e}")
+    return {}, columns, rows()
+
+
+def read_ndjson(lines: Iterator[str]):
+    numbered = ((number, line) for number, line in enumerate(lines, 1)
+                if line.strip())
+
+    def parse(number: int, line: str):
+        try:
+            value = loads(line)
+        except ValueError:
+            raise ValueError(f"Invalid JSON on line {number}")
+        if not isinstance(value, dict):
+            raise ValueError(f"Line {number} is not a JSON object")
+        return value
+
+    first = next(numbered, None)
+    header = parse(*first) if first else {}
+    columns = header.get("columns")
+    if not isinstance(columns, list):
+        raise ValueError("The first line must be a header with \"columns\"")
+    for field in ("title", "description", "indexColumn"):
+        if not isinstance(header.get(field, ""), (str, type(None))):
+            raise ValueError(f"Header field \"{field}\" must be a string")
+
+    def rows():
+        for number, line in numbered:
+            row = parse(number, line)
+            fields = row.get("values") or [], row.get("sources") or []
+            if not all(isinstance(field, list) for field in fields):
+                raise ValueError(
+                    f"Line {number}: \"values\" and \"sources\" must be lists")
+            yield fields
+
+    return header, columns, rows()
+
+
+async def import_sheet_stream(sheet_id: str, chunks: AsyncIterator[bytes],
+                              format: str, title: Optional[str],
+                              description: Optional[str],
+                              index_column: Optional[str]):
+
+    def run_import(db):
+        lines = body_lines(chunks)
+        reader = read_csv if format == CSV else read_ndjson
+        header, columns, rows = reader(lines)
+        # Query parameters win over the NDJSON header; anything left unset
+        # keeps the existing sheet's value.
+        metadata = {
+            "title": header.get("title") if title is None else title,
+            "description":
+            header.get("description") if description is None else description,
+            "index_column":
+            header.get("indexColumn")
+            if index_column is None else index_column,
+        }
+        return import_sheet(db, sheet_id, metadata, columns, rows,
+                            SHEET_TRANSFER_CHUNK_ROWS)
+
+    # The import pulls the body from the event loop while it writes, so it
+    # always runs in a worker thread on the sync engine and commits once at
+    # the end.
+    return await run_in_threadpool(with_session, run_import)
@@ -0,0 +1,80 @@
+from typing import Any, Dict, Optional
+import asyncio
+import threading
+
+
+class Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    # Merges concurrent calls with the same key onto one execution and hands
+    # its result (or exception) to every caller. Nothing is kept once the
+    # call finishes; caching results is left to TTLCache.
+
+    def __init__(self):
+        self.calls: Dict[str, Call] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key: str, fn, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    async def do_async(self, key: str, fn, *args, **kwargs):
+        # The call runs in its own task so a cancelled caller does not
+        # cancel it for everyone else waiting on the same key.
+        loop = asyncio.get_running_loop()
+        task = self.tasks.get(key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(fn(*args, **kwargs))
+            self.tasks[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda _: self.forget(key, task))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def forget(self, key: str, task: asyncio.Task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        if not task.cancelled():
+            # Marks the exception as retrieved when every caller was
+            # cancelled before the task finished.
+            task.exception()
+
+    def stats(self):
+        with self.lock:
+            in_flight = len(self.calls)
+        return {
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "in_flight": in_flight + len(self.tasks),
+        }
@@ -0,0 +1,80 @@
+from contextlib import contextmanager, nullcontext
+import asyncio
+import logging
+import os
+import time
+from src.python_backend.metrics import histogram
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+# Standard OpenTelemetry variable; the exporter reads it (and the related
+# OTEL_* settings, e.g. OTEL_SERVICE_NAME) itself.
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+
+tracer_provider = None
+
+
+def configure_tracing():
+    # Spans go to the global tracer provider. That is set up here when an
+    # OTLP endpoint is configured, or already by `opentelemetry-instrument`;
+    # otherwise (or without opentelemetry installed) spans are dropped and
+    # only the stage_seconds histograms are kept.
+    global tracer_provider
+    if trace is None or not OTEL_EXPORTER_OTLP_ENDPOINT:
+        return False
+    try:
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logger.warning(
+            "OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk or "
+            "opentelemetry-exporter-otlp-proto-http is not installed")
+        return False
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(tracer_provider)
+    return True
+
+
+def shutdown_tracing():
+    global tracer_provider
+    if tracer_provider is not None:
+        tracer_provider.shutdown()
+        tracer_provider = None
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """Times one stage of the autofill pipeline into stage_seconds, labelled
+    by outcome, and records it as an OpenTelemetry span if available."""
+    if trace is None:
+        current_span = nullcontext()
+    else:
+        current_span = trace.get_tracer(__name__).start_as_current_span(
+            stage,
+            attributes={
+                key: value
+                for key, value in attributes.items() if value is not None
+            })
+    outcome = "ok"
+    start = time.perf_counter()
+    try:
+        with current_span:
+            yield
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        histogram("stage_seconds",
+                  "Seconds spent in each autofill pipeline stage",
+                  stage=stage,
+                  outcome=outcome).observe(time.perf_counter() - start)
@@ -0,0 +1,16 @@
+"""Tests for the backend. Run from the python-backend directory:
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import tempfile
+
+# The backend reads its settings when its modules are imported, so they are
+# set here, before any test module imports it. Nothing talks to a real
+# provider; tests replace the calls they need.
+for key in ("BRAVE_API_KEY", "GROQ_API_KEY", "OPENAI_API_KEY",
+            "ANTHROPIC_API_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault(
+    "URL_DATABASE", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from src.python_backend import ai_functions
+from src.python_backend.resilience import ProviderNotConfiguredError
+
+COLUMNS = ["founded", "funding"]
+INDEX_VALUES = ["Acme", "Globex"]
+
+
+async def queries(selected_cols, index_value, description):
+    return {col_name: f"{index_value} {col_name}" for col_name in selected_cols}
+
+
+async def not_configured(*args, **kwargs):
+    raise ProviderNotConfiguredError("BRAVE_API_KEY is not set")
+
+
+async def collect(consolidation):
+    return [
+        cell async for cell in ai_functions.ai_autofill_sheet_async(
+            COLUMNS, INDEX_VALUES, "companies", consolidation=consolidation)
+    ]
+
+
+class AutofillSheetTest(unittest.IsolatedAsyncioTestCase):
+
+    async def assert_all_unknown(self, consolidation):
+        cells = await asyncio.wait_for(collect(consolidation), timeout=5)
+        self.assertEqual(
+            sorted((row, col) for row, col, _, _ in cells),
+            [(row, col) for row in range(len(INDEX_VALUES))
+             for col in range(len(COLUMNS))])
+        self.assertTrue(
+            all(value == source == "unknown" for _, _, value, source in cells))
+
+    @mock.patch.object(ai_functions, "autofill_cell_async", not_configured)
+    @mock.patch.object(ai_functions, "get_queries_to_search_async", queries)
+    async def test_failed_cells_end_the_stream(self):
+        await self.assert_all_unknown("per_column")
+
+    @mock.patch.object(ai_functions, "autofill_row_batched_async",
+                       not_configured)
+    @mock.patch.object(ai_functions, "get_queries_to_search_async", queries)
+    async def test_failed_batched_rows_end_the_stream(self):
+        await self.assert_all_unknown("batched")
+
+    @mock.patch.object(ai_functions, "get_queries_to_search_async",
+                       not_configured)
+    async def test_failed_queries_end_the_stream(self):
+        await self.assert_all_unknown("per_column")
+
+
+if __name__ == "__main__":
+    unittest.main()
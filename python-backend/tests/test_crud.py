@@ -0,0 +1,47 @@
+import unittest
+import uuid
+
+from src.python_backend.crud import get_row_count, import_sheet, set_cell
+from src.python_backend.database import with_session
+from src.python_backend.main import init_database
+
+
+def setUpModule():
+    init_database()
+
+
+def make_sheet(db, rows: int):
+    sheet_id = str(uuid.uuid4())
+    import_sheet(db, sheet_id, {
+        "title": "Companies",
+        "description": "",
+        "index_column": "company"
+    }, ["company", "founded"], ([[f"Company {r}", ""], []]
+                                for r in range(rows)), 100)
+    return sheet_id
+
+
+class SetCellTest(unittest.TestCase):
+
+    def test_writing_past_the_last_row_appends_it(self):
+
+        def run(db):
+            sheet_id = make_sheet(db, 2)
+            set_cell(db, sheet_id, 2, 0, "Company 2", None)
+            return get_row_count(db, sheet_id)
+
+        self.assertEqual(with_session(run), 3)
+
+    def test_rows_beyond_the_next_one_are_rejected(self):
+
+        def run(db):
+            sheet_id = make_sheet(db, 2)
+            with self.assertRaises(ValueError):
+                set_cell(db, sheet_id, 1000000, 0, "Company", None)
+            return get_row_count(db, sheet_id)
+
+        self.assertEqual(with_session(run), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+from unittest import mock
+import uuid
+
+from sqlalchemy import select
+
+import src.python_backend.models as models
+from src.python_backend.crud import import_sheet, read_sheet_contents
+from src.python_backend.database import run_db, with_session
+from src.python_backend import jobs
+from src.python_backend.jobs import (ALL, DONE, PENDING, RUNNING, STALE,
+                                     JobRunner, cancel_job, claim_row,
+                                     create_job, reset_expired_tasks,
+                                     store_result)
+from src.python_backend.main import init_database
+
+
+def setUpModule():
+    init_database()
+
+
+def make_job(db, rows: int, mode: str = ALL):
+    sheet_id = str(uuid.uuid4())
+    import_sheet(db, sheet_id, {
+        "title": "Companies",
+        "description": "startups",
+        "index_column": "company"
+    }, ["company", "founded"], ([[f"Company {r}", ""], []]
+                                for r in range(rows)), 100)
+    db.commit()
+    return sheet_id, create_job(db, sheet_id, None, None, None, mode)
+
+
+def task_states(db, job_id: str):
+    return db.execute(
+        select(models.AutofillTask.row_index, models.AutofillTask.status,
+               models.AutofillTask.owner).where(
+                   models.AutofillTask.job_id == job_id).order_by(
+                       models.AutofillTask.row_index)).all()
+
+
+def store(db, claim, value: str):
+    col, col_name, index_value, _ = claim["tasks"][0]
+    return store_result(db, claim, col, col_name, index_value, "query", value,
+                        "source")
+
+
+class JobQueueTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.sheet_id, self.job_id = await run_db(make_job, 2)
+
+    async def asyncTearDown(self):
+        await run_db(cancel_job, self.job_id)
+
+    async def test_racing_runners_claim_different_rows(self):
+        claims = await asyncio.gather(*[
+            run_db(claim_row, owner) for owner in ("a", "b", "c")
+        ])
+        rows = sorted(claim["row"] for claim in claims if claim)
+        self.assertEqual(rows, [0, 1])
+        states = await run_db(task_states, self.job_id)
+        self.assertEqual({owner for _, _, owner in states},
+                         {claim["owner"] for claim in claims if claim})
+
+    async def test_expired_claims_are_reclaimed_and_lose_their_results(self):
+        lost = await run_db(claim_row, "a")
+        self.assertEqual(await run_db(reset_expired_tasks, 60), 0)
+        self.assertEqual(await run_db(reset_expired_tasks, -1), 1)
+        reclaimed = await run_db(claim_row, "b")
+        self.assertEqual((reclaimed["job_id"], reclaimed["row"]),
+                         (lost["job_id"], lost["row"]))
+
+        self.assertEqual(await run_db(store, lost, "1999"), (None, None))
+        _, data, _ = await run_db(read_sheet_contents, self.sheet_id)
+        self.assertEqual(data[lost["row"]][1], "")
+        self.assertEqual(await run_db(store, reclaimed, "2001"), (DONE, None))
+        _, data, _ = await run_db(read_sheet_contents, self.sheet_id)
+        self.assertEqual(data[lost["row"]][1], "2001")
+
+    async def test_stopping_releases_this_runners_claims(self):
+        runner = JobRunner(workers=0, poll_interval=1, lease=300)
+        other = await run_db(claim_row, "other")
+        await run_db(claim_row, runner.owner)
+        await runner.stop()
+        states = await run_db(task_states, self.job_id)
+        self.assertEqual(states[other["row"]][1:], (RUNNING, "other"))
+        self.assertEqual(states[1 - other["row"]][1:], (PENDING, None))
+
+
+async def queries(selected_cols, index_value, description):
+    return {col_name: f"{index_value} {col_name}" for col_name in selected_cols}
+
+
+class RunRowTest(unittest.IsolatedAsyncioTestCase):
+
+    async def research_cache_use(self, mode: str):
+        _, job_id = await run_db(make_job, 1, mode)
+        runner = JobRunner(workers=0, poll_interval=1, lease=300)
+        research = mock.AsyncMock(return_value=("2001", "source"))
+        with mock.patch.object(jobs, "get_queries_to_search_async", queries), \
+                mock.patch.object(jobs, "research_cell_async", research):
+            await runner.run_row(await run_db(claim_row, runner.owner))
+        await run_db(cancel_job, job_id)
+        return research.await_args.args[-1]
+
+    async def test_stale_refills_skip_the_caches(self):
+        self.assertFalse(await self.research_cache_use(STALE))
+
+    async def test_full_fills_use_the_caches(self):
+        self.assertTrue(await self.research_cache_use(ALL))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from src.python_backend.metrics import Counter, Gauge, Histogram, Registry
+
+
+class RenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def render(self):
+        return self.registry.render().splitlines()
+
+    def test_counter_header_names_its_total_sample(self):
+        self.registry.get_or_create(Counter, "llm_tokens", "Tokens",
+                                    {"provider": "openai"}).inc(3)
+        self.assertEqual(self.render(), [
+            "# HELP llm_tokens_total Tokens",
+            "# TYPE llm_tokens_total counter",
+            'llm_tokens_total{provider="openai"} 3.0',
+        ])
+
+    def test_gauge_and_histogram_headers_use_the_metric_name(self):
+        self.registry.get_or_create(Gauge,
+                                    "pool_size",
+                                    "Pool size", {},
+                                    fn=lambda: 5)
+        self.registry.get_or_create(Histogram,
+                                    "stage_seconds",
+                                    "Stage latency", {},
+                                    buckets=(1.0, )).observe(0.5)
+        self.assertEqual(self.render(), [
+            "# HELP pool_size Pool size",
+            "# TYPE pool_size gauge",
+            "pool_size 5.0",
+            "# HELP stage_seconds Stage latency",
+            "# TYPE stage_seconds histogram",
+            'stage_seconds_bucket{le="1.0"} 1.0',
+            'stage_seconds_bucket{le="+Inf"} 1.0',
+            "stage_seconds_sum 0.5",
+            "stage_seconds_count 1.0",
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
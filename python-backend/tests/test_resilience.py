@@ -0,0 +1,31 @@
+import asyncio
+import time
+import unittest
+
+from src.python_backend.resilience import ProviderPolicy
+
+
+async def answer():
+    return "ok"
+
+
+class ProviderPolicyTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_cancelled_rate_limit_wait_leaves_the_trial_free(self):
+        policy = ProviderPolicy("test", rate_limit=1, reset_timeout=0)
+        policy.breaker.opened_at = time.monotonic() - 1
+        policy.rate_limiter.tokens = -10
+        waiting = asyncio.create_task(policy.call_async(answer))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertFalse(policy.breaker.trial_in_flight)
+
+        policy.rate_limiter.rate = 0
+        self.assertEqual(await policy.call_async(answer), "ok")
+        self.assertEqual(policy.breaker.state, "closed")
+
+
+if __name__ == "__main__":
+    unittest.main()